@@ -1,6 +1,7 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -8,168 +9,623 @@ from contextlib import asynccontextmanager
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, model_validator
 from typing import List, Optional
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 from passlib.context import CryptContext
 import jwt
 import io
 import csv
+import asyncio
+import bisect
+import heapq
+import hashlib
+import hmac
+import pickle
+import signal
+import time
+
+# Reference point for the cold-start time reported once the store is ready
+SERVER_IMPORTED_AT = time.perf_counter()
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Identifies the code that is running; ETags and snapshots made by other code are not reused
+CODE_FINGERPRINT = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()[:16]
+
 import json
 from pathlib import Path
+from filelock import FileLock, Timeout
 
 # ============ JSON STORAGE FALLBACK ============
+RANGE_OPERATORS = {
+    "$gt": lambda value, bound: value > bound,
+    "$gte": lambda value, bound: value >= bound,
+    "$lt": lambda value, bound: value < bound,
+    "$lte": lambda value, bound: value <= bound,
+}
+
+def matches_query(item, query):
+    for k, v in query.items():
+        if isinstance(v, dict):
+            value = item.get(k)
+            for op, operand in v.items():
+                if op == "$in":
+                    if value not in operand:
+                        return False
+                elif value is None or not RANGE_OPERATORS[op](value, operand):
+                    return False
+        elif item.get(k) != v:
+            return False
+    return True
+
+def apply_update(item, update):
+    """Copy of item with a $set / $inc (or plain field) update applied."""
+    # Copy rather than mutate: callers may still hold the cached document
+    item = dict(item)
+    if "$set" in update or "$inc" in update:
+        item.update(update.get("$set", {}))
+        for field, amount in update.get("$inc", {}).items():
+            item[field] = item.get(field, 0) + amount
+    else:
+        item.update(update)
+    return item
+
+class JSONCursor:
+    def __init__(self, data):
+        self.data = data
+
+    def sort(self, field, direction):
+        try:
+            self.data.sort(key=lambda x: x.get(field, ""), reverse=(direction == -1))
+        except Exception:
+            pass
+        return self
+
+    async def to_list(self, length):
+        return self.data[:length]
+
 class JSONCollection:
-    def __init__(self, name, data_dir):
+    """One JSON file, safe to share between worker processes.
+
+    Writes happen under a cross-process file lock and replace the file atomically.
+    A sidecar version file ("<generation> <counter>") is bumped on every write, so
+    each process keeps the parsed documents in memory and only re-reads the JSON
+    when another process has written since. The data file's mtime and size are
+    part of the version too, so edits made outside the app are picked up.
+    """
+
+    def __init__(self, name, data_dir, listeners=None, file_stem=None):
         self.name = name
-        self.file_path = data_dir / f"{name}.json"
-        if not self.file_path.exists():
-            with open(self.file_path, 'w') as f:
-                json.dump([], f)
+        file_stem = file_stem or name
+        self.file_path = data_dir / f"{file_stem}.json"
+        self.version_path = data_dir / f"{file_stem}.json.version"
+        self.lock = FileLock(str(data_dir / f"{file_stem}.json.lock"))
+        # Shared with the owning database; called as fn(collection, op, before, after)
+        self.listeners = listeners if listeners is not None else []
+        self._data = None
+        self._version = None
+        with self.lock:
+            if not self.file_path.exists():
+                self._write_atomic(self.file_path, json.dumps([]))
+            if self._read_version() is None:
+                self._write_atomic(self.version_path, f"{uuid.uuid4().hex[:12]} 0")
+
+    @property
+    def version(self):
+        """Identifies the current contents; changes whenever any process writes."""
+        self._load()
+        return self._version
+
+    def _write_atomic(self, path, text):
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def _read_version(self):
+        try:
+            with open(self.version_path, 'r') as f:
+                generation, counter = f.read().split()
+            return generation, int(counter)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _current_version(self):
+        try:
+            stat = self.file_path.stat()
+        except FileNotFoundError:
+            return None
+        return (*(self._read_version() or ("", 0)), stat.st_mtime_ns, stat.st_size)
 
     def _load(self):
+        version = self._current_version()
+        if self._data is not None and version == self._version:
+            return self._data
         try:
             with open(self.file_path, 'r') as f:
-                return json.load(f)
+                data = json.load(f)
         except (json.JSONDecodeError, FileNotFoundError):
-            return []
+            data = []
+        previous = self._data
+        self._data, self._version = data, version
+        if previous is not None:
+            self._emit_external_changes(previous, data)
+        return data
+
+    def _emit_external_changes(self, previous, current):
+        # Another process wrote: replay the difference so local listeners stay in sync
+        old = {item.get("id"): item for item in previous}
+        for item in current:
+            before = old.pop(item.get("id"), None)
+            if before is None:
+                self._emit("insert", None, item)
+            elif before != item:
+                self._emit("update", before, item)
+        for item in old.values():
+            self._emit("delete", item, None)
 
     def _save(self, data):
-        with open(self.file_path, 'w') as f:
-            json.dump(data, f, indent=2)
+        # Callers hold self.lock and loaded data through _load() under it
+        self._write_atomic(self.file_path, json.dumps(data, indent=2))
+        generation, counter = self._read_version() or (uuid.uuid4().hex[:12], 0)
+        self._write_atomic(self.version_path, f"{generation} {counter + 1}")
+        self._data = data
+        self._version = self._current_version()
+
+    def _emit(self, op, before, after):
+        for listener in self.listeners:
+            try:
+                listener(self.name, op, before, after)
+            except Exception:
+                logging.getLogger(__name__).exception("Change listener failed for %s", self.name)
 
     async def find_one(self, query, projection=None):
         data = self._load()
         for item in data:
-            match = True
-            for k, v in query.items():
-                if isinstance(v, dict) and "$in" in v:
-                    if item.get(k) not in v["$in"]:
-                        match = False
-                        break
-                elif item.get(k) != v:
-                    match = False
-                    break
-            if match:
+            if matches_query(item, query):
                 return item
         return None
 
     async def insert_one(self, document):
-        data = self._load()
-        data.append(document)
-        self._save(data)
+        with self.lock:
+            data = self._load()
+            data.append(document)
+            self._save(data)
+        self._emit("insert", None, document)
         return type('obj', (object,), {'inserted_id': document.get('id', str(uuid.uuid4()))})
 
     async def update_one(self, query, update):
-        data = self._load()
-        updated = False
-        for item in data:
-            match = True
-            for k, v in query.items():
-                if item.get(k) != v:
-                    match = False
+        with self.lock:
+            data = self._load()
+            updated = False
+            for position, before in enumerate(data):
+                if matches_query(before, query):
+                    item = apply_update(before, update)
+                    data[position] = item
+                    updated = True
                     break
-            if match:
-                if "$set" in update:
-                    item.update(update["$set"])
-                else:
-                    item.update(update)
-                updated = True
-                break
+            if updated:
+                self._save(data)
         if updated:
-            self._save(data)
+            self._emit("update", before, item)
         return type('obj', (object,), {'modified_count': 1 if updated else 0})
 
+    async def bulk_update(self, operations):
+        """Apply (query, update) pairs like update_one, in one locked load and save of the file.
+
+        Queries on "id" are looked up by position instead of scanning the file for each one.
+        """
+        modified = []
+        changes = []
+        with self.lock:
+            data = self._load()
+            positions = {item.get("id"): position for position, item in enumerate(data)}
+            for query, update in operations:
+                if "id" in query:
+                    position = positions.get(query["id"])
+                    candidates = [] if position is None else [position]
+                else:
+                    candidates = range(len(data))
+                match = next((p for p in candidates if matches_query(data[p], query)), None)
+                modified.append(match is not None)
+                if match is not None:
+                    before = data[match]
+                    data[match] = apply_update(before, update)
+                    changes.append((before, data[match]))
+            if changes:
+                self._save(data)
+        for before, after in changes:
+            self._emit("update", before, after)
+        return type('obj', (object,), {'modified_count': len(changes), 'modified': modified})
+
     async def delete_one(self, query):
-        data = self._load()
-        initial_len = len(data)
-        data = [item for item in data if not all(item.get(k) == v for k, v in query.items())]
-        self._save(data)
-        return type('obj', (object,), {'deleted_count': initial_len - len(data)})
+        with self.lock:
+            data = self._load()
+            removed = [item for item in data if matches_query(item, query)]
+            if removed:
+                self._save([item for item in data if not matches_query(item, query)])
+        for item in removed:
+            self._emit("delete", item, None)
+        return type('obj', (object,), {'deleted_count': len(removed)})
 
     async def count_documents(self, query):
         data = self._load()
         count = 0
         for item in data:
-            match = True
-            for k, v in query.items():
-                if isinstance(v, dict) and "$in" in v:
-                    if item.get(k) not in v["$in"]:
-                        match = False
-                        break
-                elif item.get(k) != v:
-                    match = False
-                    break
-            if match:
+            if matches_query(item, query):
                 count += 1
         return count
 
     def find(self, query=None, projection=None):
         data = self._load()
-        
-        class Cursor:
-            def __init__(self, data):
-                self.data = data
-            def sort(self, field, direction):
-                try:
-                    self.data.sort(key=lambda x: x.get(field, ""), reverse=(direction == -1))
-                except Exception:
-                    pass
-                return self
-            async def to_list(self, length):
-                return self.data[:length]
 
         if not query:
-            return Cursor(data)
+            # Copy so sorting the cursor leaves the cached list alone
+            return JSONCursor(list(data))
         
         filtered = []
         for item in data:
-            match = True
-            for k, v in query.items():
-                if isinstance(v, dict) and "$in" in v:
-                    if item.get(k) not in v["$in"]:
-                        match = False
-                        break
-                elif item.get(k) != v:
-                    match = False
-                    break
-            if match:
+            if matches_query(item, query):
                 filtered.append(item)
         
-        return Cursor(filtered)
+        return JSONCursor(filtered)
+
+UNDATED_PARTITION = "undated"
+
+def partition_key(value):
+    """Month ("YYYY-MM") a date or timestamp string falls in."""
+    if isinstance(value, str) and len(value) >= 7 and value[4] == "-" and value[:4].isdigit() and value[5:7].isdigit():
+        return value[:7]
+    return UNDATED_PARTITION
+
+def partition_bounds(condition):
+    """Inclusive (first, last) months a query condition on the partition field can match."""
+    if isinstance(condition, str):
+        return partition_key(condition), partition_key(condition)
+    first = last = None
+    if isinstance(condition, dict):
+        for op in ("$gt", "$gte"):
+            if op in condition and partition_key(condition[op]) != UNDATED_PARTITION:
+                first = partition_key(condition[op])
+        for op in ("$lt", "$lte"):
+            if op in condition and partition_key(condition[op]) != UNDATED_PARTITION:
+                last = partition_key(condition[op])
+    return first, last
+
+class PartitionedJSONCollection:
+    """A collection stored as one JSONCollection per month of partition_field.
+
+    Hot months live in data/<name>/<YYYY-MM>.json and archived documents in
+    data/<name>/archive/<YYYY-MM>.json. Queries that constrain partition_field only
+    open the months they can match, and the archive is read only on request.
+    """
+
+    def __init__(self, name, data_dir, partition_field, listeners=None):
+        self.name = name
+        self.partition_field = partition_field
+        self.hot_dir = data_dir / name
+        self.cold_dir = self.hot_dir / "archive"
+        self.cold_dir.mkdir(parents=True, exist_ok=True)
+        self.listeners = listeners if listeners is not None else []
+        self._hot_listeners = [self._forward]
+        self.hot = {}
+        self.cold = {}
+        self._ids = {}  # month -> (partition version, ids in it)
+        self._archived = {}  # month -> (archive file version, ids in it)
+        self._scanned = False  # set once the hot months present at startup are known
+        self._migrate_flat_file(data_dir / f"{name}.json")
+
+    def _open(self, directory, partitions, cold):
+        # Other workers may have started new months since we last looked
+        for path in directory.glob("*.json"):
+            if path.stem not in partitions:
+                self._partition(path.stem, cold)
+        return partitions
+
+    def _hot_partitions(self):
+        partitions = self._open(self.hot_dir, self.hot, cold=False)
+        self._scanned = True
+        return partitions
+
+    def _cold_partitions(self):
+        return self._open(self.cold_dir, self.cold, cold=True)
+
+    def _partition(self, month, cold=False):
+        partitions = self.cold if cold else self.hot
+        if month not in partitions:
+            directory = self.cold_dir if cold else self.hot_dir
+            listeners = [] if cold else self._hot_listeners
+            partition = JSONCollection(self.name, directory, listeners, file_stem=month)
+            if not cold and self._scanned:
+                # A month that appeared after startup starts out empty, so whatever another
+                # worker already wrote to it reaches the listeners as inserts on first load
+                partition._data = []
+            partitions[month] = partition
+        return partitions[month]
+
+    def _migrate_flat_file(self, flat_path):
+        # Collections written before partitioning lived in a single <name>.json
+        if not flat_path.exists():
+            return
+        with FileLock(f"{flat_path}.lock"):
+            if not flat_path.exists():
+                return
+            try:
+                with open(flat_path, 'r') as f:
+                    documents = json.load(f)
+            except json.JSONDecodeError:
+                documents = []
+            by_month = {}
+            for document in documents:
+                by_month.setdefault(partition_key(document.get(self.partition_field)), []).append(document)
+            for month, month_documents in by_month.items():
+                partition = self._partition(month)
+                with partition.lock:
+                    data = partition._load()
+                    existing = {item.get("id") for item in data}
+                    partition._save(data + [d for d in month_documents if d.get("id") not in existing])
+            flat_path.rename(flat_path.with_name(f"{flat_path.name}.migrated"))
+
+    def _forward(self, collection, op, before, after):
+        # A document another worker moved to the archive shows up here as a delete
+        if op == "delete":
+            cold_path = self.cold_dir / f"{partition_key(before.get(self.partition_field))}.json"
+            if cold_path.exists() and before.get("id") in self._archived_ids(cold_path.stem):
+                op = "archive"
+        for listener in self.listeners:
+            listener(collection, op, before, after)
+
+    def _select(self, query, include_archived=False):
+        first, last = partition_bounds((query or {}).get(self.partition_field))
+        stores = [self._hot_partitions()]
+        if include_archived:
+            stores.append(self._cold_partitions())
+        selected = []
+        for partitions in stores:
+            for month in sorted(partitions):
+                if month != UNDATED_PARTITION and ((first and month < first) or (last and month > last)):
+                    continue
+                selected.append(partitions[month])
+        return selected
+
+    def _locate(self, query):
+        """Hot partitions that can hold a match, narrowed to one when querying by id."""
+        document_id = query.get("id")
+        if not isinstance(document_id, str):
+            return self._select(query)
+        # Newest months first: recent documents are the ones being looked up
+        for month, partition in sorted(self._hot_partitions().items(), reverse=True):
+            if document_id in self._month_ids(month, partition):
+                return [partition]
+        return []
+
+    def _month_ids(self, month, partition):
+        version = partition.version
+        cached = self._ids.get(month)
+        if cached is None or cached[0] != version:
+            cached = (version, {item.get("id") for item in partition._load()})
+            self._ids[month] = cached
+        return cached[1]
+
+    def _archived_ids(self, month):
+        # Parsed without keeping the documents: telling archives from deletes must not load the archive
+        cold = self._partition(month, cold=True)
+        version = cold._current_version()
+        cached = self._archived.get(month)
+        if cached is None or cached[0] != version:
+            if cold._data is not None and cold._version == version:
+                documents = cold._data
+            else:
+                try:
+                    with open(cold.file_path, 'r') as f:
+                        documents = json.load(f)
+                except (json.JSONDecodeError, FileNotFoundError):
+                    documents = []
+            cached = (version, {item.get("id") for item in documents})
+            self._archived[month] = cached
+        return cached[1]
+
+    @property
+    def version(self):
+        # Archived months are only stat'ed: comparing versions must not load the archive
+        return (
+            tuple((month, partition.version) for month, partition in sorted(self._hot_partitions().items())),
+            tuple((month, partition._current_version()) for month, partition in sorted(self._cold_partitions().items())),
+        )
+
+    def _load(self, include_archived=False):
+        data = []
+        for partition in self._select({}, include_archived):
+            data.extend(partition._load())
+        return data
+
+    def _files(self):
+        return [*self._hot_partitions().values(), *self._cold_partitions().values()]
+
+    async def find_one(self, query, projection=None):
+        for partition in self._locate(query):
+            item = await partition.find_one(query, projection)
+            if item is not None:
+                return item
+        return None
+
+    async def insert_one(self, document):
+        partition = self._partition(partition_key(document.get(self.partition_field)))
+        return await partition.insert_one(document)
+
+    async def update_one(self, query, update):
+        for partition in self._locate(query):
+            result = await partition.update_one(query, update)
+            if result.modified_count:
+                return result
+        return type('obj', (object,), {'modified_count': 0})
+
+    async def bulk_update(self, operations):
+        """bulk_update on each partition the operations touch, one write per partition."""
+        months = [
+            (partition, self._month_ids(month, partition))
+            for month, partition in sorted(self._hot_partitions().items(), reverse=True)
+        ]
+        by_partition = {}
+        for position, (query, update) in enumerate(operations):
+            document_id = query.get("id")
+            if isinstance(document_id, str):
+                targets = [partition for partition, ids in months if document_id in ids][:1]
+            else:
+                targets = self._select(query)
+            for partition in targets:
+                by_partition.setdefault(id(partition), (partition, []))[1].append((position, query, update))
+        modified = [False] * len(operations)
+        for partition, batch in by_partition.values():
+            result = await partition.bulk_update([(query, update) for _, query, update in batch])
+            for (position, _, _), was_modified in zip(batch, result.modified):
+                modified[position] = modified[position] or was_modified
+        return type('obj', (object,), {'modified_count': sum(modified), 'modified': modified})
+
+    async def delete_one(self, query):
+        deleted = 0
+        for partition in self._locate(query):
+            deleted += (await partition.delete_one(query)).deleted_count
+        return type('obj', (object,), {'deleted_count': deleted})
+
+    async def count_documents(self, query, include_archived=False):
+        count = 0
+        for partition in self._select(query, include_archived):
+            count += await partition.count_documents(query)
+        return count
+
+    def find(self, query=None, projection=None, include_archived=False):
+        data = []
+        for partition in self._select(query, include_archived):
+            data.extend(partition.find(query, projection).data)
+        return JSONCursor(data)
+
+    def archive(self, cutoff, query):
+        """Move documents matching query whose partition field is before cutoff into the archive."""
+        moved = 0
+        for month, partition in sorted(self._hot_partitions().items()):
+            if month == UNDATED_PARTITION or month > partition_key(cutoff):
+                continue
+            with partition.lock:
+                data = partition._load()
+                leaving = [
+                    item for item in data
+                    if matches_query(item, query) and str(item.get(self.partition_field)) < cutoff
+                ]
+                if not leaving:
+                    continue
+                # Archive first: a crash in between leaves a duplicate, never a loss
+                cold = self._partition(month, cold=True)
+                with cold.lock:
+                    cold_data = cold._load()
+                    archived = {item.get("id") for item in cold_data}
+                    cold._save(cold_data + [item for item in leaving if item.get("id") not in archived])
+                leaving_ids = {item.get("id") for item in leaving}
+                partition._save([item for item in data if item.get("id") not in leaving_ids])
+            for item in leaving:
+                partition._emit("archive", item, None)
+            moved += len(leaving)
+        return moved
 
 class JSONDatabase:
     def __init__(self, data_dir):
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(parents=True, exist_ok=True)
-        self.users = JSONCollection("users", self.data_dir)
-        self.vehicles = JSONCollection("vehicles", self.data_dir)
-        self.drivers = JSONCollection("drivers", self.data_dir)
-        self.trips = JSONCollection("trips", self.data_dir)
-        self.maintenance_logs = JSONCollection("maintenance_logs", self.data_dir)
-        self.fuel_logs = JSONCollection("fuel_logs", self.data_dir)
-        self.expense_logs = JSONCollection("expense_logs", self.data_dir)
+        self.listeners = []
+        self.users = JSONCollection("users", self.data_dir, self.listeners)
+        self.vehicles = JSONCollection("vehicles", self.data_dir, self.listeners)
+        self.drivers = JSONCollection("drivers", self.data_dir, self.listeners)
+        # Ever-growing collections are split by month
+        self.trips = PartitionedJSONCollection("trips", self.data_dir, "created_at", self.listeners)
+        self.maintenance_logs = PartitionedJSONCollection("maintenance_logs", self.data_dir, "service_date", self.listeners)
+        self.fuel_logs = PartitionedJSONCollection("fuel_logs", self.data_dir, "date", self.listeners)
+        self.expense_logs = PartitionedJSONCollection("expense_logs", self.data_dir, "date", self.listeners)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def collections(self):
+        return [
+            value for value in vars(self).values()
+            if isinstance(value, (JSONCollection, PartitionedJSONCollection))
+        ]
+
+    def files(self):
+        """Every JSONCollection backing the store, partitions included."""
+        files = []
+        for collection in self.collections():
+            files.extend(collection._files() if isinstance(collection, PartitionedJSONCollection) else [collection])
+        return files
+
+    def refresh(self):
+        """Pick up writes made by other worker processes."""
+        for collection in self.collections():
+            collection._load()
 
 # Initialize JSON DB
-data_dir = ROOT_DIR / "data"
+data_dir = Path(os.getenv("DATA_DIR", ROOT_DIR / "data"))
 db = JSONDatabase(data_dir)
 
 # JWT and Password Configuration
-SECRET_KEY = os.getenv("SECRET_KEY", "fleetflow-secret-key-change-in-production")
+DEFAULT_SECRET_KEY = "fleetflow-secret-key-change-in-production"
+SECRET_KEY = os.getenv("SECRET_KEY", DEFAULT_SECRET_KEY)
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
+# Tokens for the event stream travel in the URL, where access logs keep them
+EVENT_STREAM_TOKEN_SECONDS = 60
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
+# How often each worker checks for writes made by the others
+STORE_REFRESH_SECONDS = float(os.getenv("STORE_REFRESH_SECONDS", "1.0"))
+
+# Finished trips older than this move to the cold archive partitions
+ARCHIVE_TRIPS_AFTER_DAYS = int(os.getenv("ARCHIVE_TRIPS_AFTER_DAYS", "90"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "21600"))
+FINISHED_TRIP_STATUSES = ["Completed", "Cancelled"]
+
+async def refresh_store_periodically():
+    while True:
+        await asyncio.sleep(STORE_REFRESH_SECONDS)
+        try:
+            db.refresh()
+        except Exception:
+            logging.getLogger(__name__).exception("Store refresh failed")
+
+async def archive_trips_periodically():
+    while True:
+        try:
+            cutoff = (datetime.now(timezone.utc) - timedelta(days=ARCHIVE_TRIPS_AFTER_DAYS)).isoformat()
+            moved = db.trips.archive(cutoff, {"status": {"$in": FINISHED_TRIP_STATUSES}})
+            if moved:
+                logging.getLogger(__name__).info("Archived %d trips created before %s", moved, cutoff)
+        except Exception:
+            logging.getLogger(__name__).exception("Trip archiving failed")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    warm_start()
+    await backfill_driver_stats()
+    background_tasks = [
+        asyncio.create_task(refresh_store_periodically()),
+        asyncio.create_task(archive_trips_periodically()),
+    ]
+    if SNAPSHOTS_ENABLED:
+        background_tasks.append(asyncio.create_task(snapshot_periodically()))
     yield
+    for task in background_tasks:
+        task.cancel()
+    try:
+        if claim_snapshot_writer():
+            write_snapshot()
+            snapshot_writer_lock.release(force=True)
+    except Exception:
+        logging.getLogger(__name__).exception("Snapshot on shutdown failed")
 
 app = FastAPI(lifespan=lifespan)
 api_router = APIRouter(prefix="/api")
@@ -181,18 +637,21 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def create_access_token(data: dict):
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await get_user_from_token(credentials.credentials)
+
+async def get_user_from_token(token: str, scope: Optional[str] = None):
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
-        if user_id is None:
+        # Scoped tokens only open what they were issued for, and nothing else opens it
+        if user_id is None or payload.get("scope") != scope:
             raise HTTPException(status_code=401, detail="Invalid authentication")
         
         user = await db.users.find_one({"id": user_id}, {"_id": 0})
@@ -201,7 +660,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 # ============ MODELS ============
@@ -244,6 +703,15 @@ class VehicleCreate(BaseModel):
     max_capacity: float
     odometer: float = 0.0
 
+def driver_completion_rate(driver: dict):
+    """Share of the trips a driver set out on that were completed rather than cancelled en route."""
+    completed = driver.get("trips_completed", 0)
+    finished = completed + driver.get("trips_cancelled", 0)
+    if not finished:
+        # Drivers recorded before the trip counters existed keep their stored rate
+        return driver.get("trip_completion_rate", 0.0)
+    return round(completed / finished * 100, 1)
+
 class Driver(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -253,10 +721,22 @@ class Driver(BaseModel):
     phone: str
     status: str = "Off Duty"  # On Duty, Off Duty, Suspended
     safety_score: float = 100.0
-    trip_completion_rate: float = 0.0
+    trip_completion_rate: float = 0.0  # Derived from the trip counters below
     total_trips: int = 0
+    trips_assigned: int = 0
+    trips_dispatched: int = 0
+    trips_completed: int = 0
+    trips_cancelled: int = 0
+    distance_driven: float = 0.0
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
+    @model_validator(mode="before")
+    @classmethod
+    def derive_completion_rate(cls, data):
+        if isinstance(data, dict):
+            data = {**data, "trip_completion_rate": driver_completion_rate(data)}
+        return data
+
 class DriverCreate(BaseModel):
     name: str
     license_number: str
@@ -275,6 +755,7 @@ class Trip(BaseModel):
     status: str = "Draft"  # Draft, Dispatched, In Progress, Completed, Cancelled
     distance: float = 0.0
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    dispatched_at: Optional[str] = None
     completed_at: Optional[str] = None
 
 class TripCreate(BaseModel):
@@ -337,6 +818,762 @@ class ExpenseLogCreate(BaseModel):
     date: str
     notes: str = ""
 
+class DispatchPlanRequest(BaseModel):
+    trip_ids: Optional[List[str]] = None  # Defaults to every Draft trip
+    apply: bool = False  # Write the chosen vehicle and driver onto the trips
+
+# ============ LIVE EVENTS ============
+ACTIVE_TRIP_STATUSES = ["Dispatched", "In Progress"]
+
+# Counters shown on the dashboard, expressed as queries so they can be evaluated
+# against the stored collections and against single documents when they change.
+DASHBOARD_COUNTERS = {
+    "vehicles": {
+        "total_vehicles": {"out_of_service": False},
+        "active_fleet": {"status": "On Trip"},
+        "maintenance_alerts": {"status": "In Shop"},
+        "ready_vehicles": {"status": "Ready"},
+    },
+    "trips": {
+        "pending_cargo": {"status": "Draft"},
+        "active_trips": {"status": {"$in": ACTIVE_TRIP_STATUSES}},
+        "completed_trips": {"status": "Completed"},
+    },
+    "drivers": {
+        "active_drivers": {"status": "On Duty"},
+    },
+}
+
+# Collections broadcast to clients, keyed to the entity name used in event types.
+# Users are deliberately absent: their documents carry password hashes.
+EVENT_ENTITIES = {
+    "vehicles": "vehicle",
+    "drivers": "driver",
+    "trips": "trip",
+    "maintenance_logs": "maintenance_log",
+    "fuel_logs": "fuel_log",
+    "expense_logs": "expense_log",
+}
+
+TRIP_STATUS_EVENTS = {
+    "Dispatched": "trip.dispatched",
+    "Completed": "trip.completed",
+    "Cancelled": "trip.cancelled",
+}
+
+SSE_KEEPALIVE_SECONDS = 15
+
+def dashboard_counter_delta(collection, before, after):
+    delta = {}
+    for counter, query in DASHBOARD_COUNTERS.get(collection, {}).items():
+        change = int(after is not None and matches_query(after, query)) - int(before is not None and matches_query(before, query))
+        if change:
+            delta[counter] = change
+    return delta
+
+class EventBroker:
+    """Fans change events out to every connected client from a single publisher."""
+
+    def __init__(self, max_queue_size=256):
+        self.max_queue_size = max_queue_size
+        self.subscribers = set()
+        self.sequence = 0
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def message(self, event_type, data):
+        """An SSE message stamped with the id of the last event published so far."""
+        return f"id: {self.sequence}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+    def publish(self, event_type, data):
+        self.sequence += 1
+        # Serialize once, however many clients are listening
+        message = self.message(event_type, data)
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Client fell behind: drop its backlog and tell it to refetch
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.message("resync", {}))
+
+def change_event_type(collection, op, before, after):
+    entity = EVENT_ENTITIES[collection]
+    if op == "insert":
+        return f"{entity}.created"
+    if op == "delete":
+        return f"{entity}.deleted"
+    if op == "archive":
+        return f"{entity}.archived"
+    if before.get("status") != after.get("status"):
+        if collection == "trips":
+            return TRIP_STATUS_EVENTS.get(after.get("status"), "trip.status_changed")
+        return f"{entity}.status_changed"
+    return f"{entity}.updated"
+
+def publish_change(collection, op, before, after):
+    if collection not in EVENT_ENTITIES:
+        return
+    document = after if after is not None else before
+    event_broker.publish(change_event_type(collection, op, before, after), {
+        "id": document.get("id"),
+        "previous_status": before.get("status") if before else None,
+        "document": after,
+    })
+    # Archived documents still count towards the dashboard totals
+    delta = dashboard_counter_delta(collection, before, after) if op != "archive" else {}
+    if delta:
+        event_broker.publish("dashboard.delta", delta)
+
+event_broker = EventBroker()
+db.add_listener(publish_change)
+
+class StatusCounters:
+    """Current value of every DASHBOARD_COUNTERS entry, adjusted per change instead of recounted."""
+
+    def __init__(self, database):
+        self.database = database
+        self.loaded = False
+        self.counts = {}
+
+    def load(self):
+        self.counts = {}
+        for collection, counters in DASHBOARD_COUNTERS.items():
+            store = getattr(self.database, collection)
+            # Archived trips still count towards completed_trips
+            documents = store._load(include_archived=True) if isinstance(store, PartitionedJSONCollection) else store._load()
+            for counter, query in counters.items():
+                self.counts[counter] = sum(1 for document in documents if matches_query(document, query))
+        self.loaded = True
+
+    def on_change(self, collection, op, before, after):
+        if not self.loaded or op == "archive":
+            return
+        for counter, change in dashboard_counter_delta(collection, before, after).items():
+            self.counts[counter] += change
+
+status_counters = StatusCounters(db)
+db.add_listener(status_counters.on_change)
+
+# ============ CONDITIONAL GET ============
+# Serialized response bodies keyed by endpoint, valid while the versions of the
+# collections they were built from are unchanged. Kept per process only: a body
+# is never reused by code other than the code that built it.
+response_cache = {}
+RESPONSE_CACHE_SIZE = 256
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as required for If-None-Match
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+def date_range_query(field, start: Optional[str], end: Optional[str]):
+    """Query on field for the inclusive YYYY-MM-DD range; lets partitioned collections skip months."""
+    condition = {}
+    try:
+        if start:
+            condition["$gte"] = date.fromisoformat(start).isoformat()
+        if end:
+            condition["$lt"] = (date.fromisoformat(end) + timedelta(days=1)).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be in YYYY-MM-DD format")
+    return {field: condition} if condition else {}
+
+async def versioned_response(request: Request, key: str, collections, build):
+    versions = tuple(collection.version for collection in collections)
+    # The code fingerprint changes the ETag on deploy, even when the data did not change
+    etag = f'W/"{key}-{hashlib.sha1(repr((CODE_FINGERPRINT, versions)).encode()).hexdigest()[:20]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    cached = response_cache.get(key)
+    if cached and cached[0] == versions:
+        body = cached[1]
+    else:
+        body = json.dumps(jsonable_encoder(await build())).encode()
+        if key not in response_cache and len(response_cache) >= RESPONSE_CACHE_SIZE:
+            response_cache.pop(next(iter(response_cache)))
+        response_cache[key] = (versions, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# ============ DISPATCH PLANNING ============
+def license_expiry_date(driver):
+    expiry_date = datetime.fromisoformat(driver["license_expiry"].replace('Z', '+00:00'))
+    if expiry_date.tzinfo is None:
+        expiry_date = expiry_date.replace(tzinfo=timezone.utc)
+    return expiry_date
+
+def vehicle_is_ready(vehicle):
+    return vehicle.get("status") == "Ready" and not vehicle.get("out_of_service")
+
+class DispatchIndex:
+    """Ready vehicles ordered by capacity and dispatchable drivers, kept current from change events."""
+
+    def __init__(self, database):
+        self.database = database
+        self.loaded = False
+        self.vehicle_capacity = {}  # vehicle id -> max capacity, Ready and in service only
+        self.by_capacity = []  # sorted (max_capacity, vehicle id)
+        self.drivers = {}  # driver id -> driver, suspended drivers excluded
+        self.active_trips = {}  # driver id -> number of Dispatched / In Progress trips
+
+    def load(self):
+        self.vehicle_capacity.clear()
+        self.by_capacity.clear()
+        self.drivers.clear()
+        self.active_trips.clear()
+        for vehicle in self.database.vehicles._load():
+            self._add_vehicle(vehicle)
+        for driver in self.database.drivers._load():
+            self._add_driver(driver)
+        for trip in self.database.trips._load():
+            self._add_trip(trip)
+        self.loaded = True
+
+    def on_change(self, collection, op, before, after):
+        if not self.loaded:
+            return
+        if collection == "vehicles":
+            self._remove_vehicle(before)
+            self._add_vehicle(after)
+        elif collection == "drivers":
+            self._remove_driver(before)
+            self._add_driver(after)
+        elif collection == "trips":
+            self._remove_trip(before)
+            self._add_trip(after)
+
+    def _add_vehicle(self, vehicle):
+        if vehicle is None or not vehicle_is_ready(vehicle):
+            return
+        capacity = float(vehicle.get("max_capacity", 0))
+        self.vehicle_capacity[vehicle["id"]] = capacity
+        bisect.insort(self.by_capacity, (capacity, vehicle["id"]))
+
+    def _remove_vehicle(self, vehicle):
+        if vehicle is None or vehicle["id"] not in self.vehicle_capacity:
+            return
+        entry = (self.vehicle_capacity.pop(vehicle["id"]), vehicle["id"])
+        del self.by_capacity[bisect.bisect_left(self.by_capacity, entry)]
+
+    def _add_driver(self, driver):
+        if driver is not None and driver.get("status") != "Suspended":
+            self.drivers[driver["id"]] = driver
+
+    def _remove_driver(self, driver):
+        if driver is not None:
+            self.drivers.pop(driver["id"], None)
+
+    def _add_trip(self, trip):
+        if trip is not None and trip.get("status") in ACTIVE_TRIP_STATUSES:
+            self.active_trips[trip["driver_id"]] = self.active_trips.get(trip["driver_id"], 0) + 1
+
+    def _remove_trip(self, trip):
+        if trip is None or trip.get("status") not in ACTIVE_TRIP_STATUSES:
+            return
+        remaining = self.active_trips.get(trip["driver_id"], 0) - 1
+        if remaining > 0:
+            self.active_trips[trip["driver_id"]] = remaining
+        else:
+            self.active_trips.pop(trip["driver_id"], None)
+
+    def eligible_drivers(self, now):
+        eligible = []
+        for driver_id, driver in self.drivers.items():
+            if driver_id in self.active_trips:
+                continue
+            try:
+                if license_expiry_date(driver) < now:
+                    continue
+            except (KeyError, ValueError):
+                continue
+            eligible.append(driver)
+        # Safest drivers are handed out first
+        eligible.sort(key=lambda d: d.get("safety_score", 0), reverse=True)
+        return eligible
+
+    def plan(self, trips, now, held_vehicles=(), held_drivers=()):
+        """Best-fit decreasing: heaviest cargo first, each onto the smallest Ready vehicle that holds it.
+
+        Vehicles and drivers in held_vehicles / held_drivers are already promised to other trips.
+        """
+        available = [entry for entry in self.by_capacity if entry[1] not in held_vehicles]
+        drivers = [driver for driver in self.eligible_drivers(now) if driver["id"] not in held_drivers]
+        next_driver = 0
+        assignments = []
+        unassigned = []
+
+        for trip in sorted(trips, key=lambda t: t["cargo_weight"], reverse=True):
+            slot = bisect.bisect_left(available, (trip["cargo_weight"], ""))
+            if slot == len(available):
+                unassigned.append({"trip_id": trip["id"], "reason": "No Ready vehicle with enough capacity"})
+                continue
+            if next_driver == len(drivers):
+                unassigned.append({"trip_id": trip["id"], "reason": "No eligible driver available"})
+                continue
+            capacity, vehicle_id = available.pop(slot)
+            driver = drivers[next_driver]
+            next_driver += 1
+            assignments.append({
+                "trip_id": trip["id"],
+                "vehicle_id": vehicle_id,
+                "driver_id": driver["id"],
+                "cargo_weight": trip["cargo_weight"],
+                "vehicle_capacity": capacity,
+                "spare_capacity": round(capacity - trip["cargo_weight"], 2)
+            })
+
+        return {
+            "assignments": assignments,
+            "unassigned": unassigned,
+            "total_spare_capacity": round(sum(a["spare_capacity"] for a in assignments), 2)
+        }
+
+dispatch_index = DispatchIndex(db)
+db.add_listener(dispatch_index.on_change)
+
+# ============ SEARCH ============
+SEARCH_FIELDS = {
+    "vehicles": ["name", "model", "license_plate"],
+    "drivers": ["name", "license_number", "phone"],
+    "trips": ["origin", "destination", "cargo_description"],
+}
+
+SEARCH_GRAM_SIZE = 3
+
+# Substring-only matches rank last; looking for them stops after this many candidates
+SEARCH_SUBSTRING_SCAN_LIMIT = 2000
+
+# Prefix terms keep this many characters from where they start, so a field costs
+# memory linear in its length; longer queries are checked against the full value
+SEARCH_TERM_LENGTH = 64
+
+def trigrams(text):
+    return {text[i:i + SEARCH_GRAM_SIZE] for i in range(len(text) - SEARCH_GRAM_SIZE + 1)}
+
+def word_start_positions(text):
+    """Positions after the first at which a word begins."""
+    return [i for i in range(1, len(text)) if not text[i - 1].isalnum()]
+
+class SearchIndex:
+    """Sorted field and word-start lists per collection for ranked prefix matches, plus trigrams for substrings."""
+
+    def __init__(self, database):
+        self.database = database
+        self.loaded = False
+        self.entries = {}  # (collection, id) -> {field: original value}
+        self.grams = {collection: {} for collection in SEARCH_FIELDS}  # trigram -> set of ids
+        # sorted (up to SEARCH_TERM_LENGTH characters of the value from offset on, id, field, offset)
+        self.field_starts = {collection: [] for collection in SEARCH_FIELDS}  # offset 0 only
+        self.word_starts = {collection: [] for collection in SEARCH_FIELDS}  # offset of each word
+
+    def load(self):
+        self.entries.clear()
+        for collection in SEARCH_FIELDS:
+            self.grams[collection].clear()
+            self.field_starts[collection].clear()
+            self.word_starts[collection].clear()
+            for document in getattr(self.database, collection)._load():
+                self._add(collection, document, sort=False)
+            self.field_starts[collection].sort()
+            self.word_starts[collection].sort()
+        self.loaded = True
+
+    def on_change(self, collection, op, before, after):
+        if not self.loaded or collection not in SEARCH_FIELDS:
+            return
+        if before is not None:
+            self._remove(collection, before["id"])
+        if after is not None:
+            self._add(collection, after)
+
+    def _index_terms(self, document_id, fields):
+        grams = set()
+        field_starts = []
+        word_starts = []
+        for field, value in fields.items():
+            text = value.lower()
+            if not text:
+                continue
+            grams |= trigrams(text)
+            field_starts.append((text[:SEARCH_TERM_LENGTH], document_id, field, 0))
+            word_starts.extend(
+                (text[i:i + SEARCH_TERM_LENGTH], document_id, field, i) for i in word_start_positions(text)
+            )
+        return grams, field_starts, word_starts
+
+    def _add(self, collection, document, sort=True):
+        key = (collection, document["id"])
+        fields = {field: str(document.get(field) or "") for field in SEARCH_FIELDS[collection]}
+        self.entries[key] = fields
+        grams, field_starts, word_starts = self._index_terms(document["id"], fields)
+        for gram in grams:
+            self.grams[collection].setdefault(gram, set()).add(document["id"])
+        for ordered, terms in ((self.field_starts[collection], field_starts), (self.word_starts[collection], word_starts)):
+            for term in terms:
+                if sort:
+                    bisect.insort(ordered, term)
+                else:
+                    ordered.append(term)
+
+    def _remove(self, collection, document_id):
+        fields = self.entries.pop((collection, document_id), None)
+        if fields is None:
+            return
+        grams, field_starts, word_starts = self._index_terms(document_id, fields)
+        for gram in grams:
+            postings = self.grams[collection].get(gram)
+            if postings is not None:
+                postings.discard(document_id)
+                if not postings:
+                    del self.grams[collection][gram]
+        for ordered, terms in ((self.field_starts[collection], field_starts), (self.word_starts[collection], word_starts)):
+            for term in terms:
+                i = bisect.bisect_left(ordered, term)
+                if i < len(ordered) and ordered[i] == term:
+                    del ordered[i]
+
+    def _prefix_matches(self, starts, query, collections):
+        """(key, field) for each indexed start beginning with query, in order across collections."""
+        probe = query[:SEARCH_TERM_LENGTH]
+
+        def matches(collection):
+            ordered = starts[collection]
+            i = bisect.bisect_left(ordered, (probe,))
+            while i < len(ordered) and ordered[i][0].startswith(probe):
+                text, document_id, field, offset = ordered[i]
+                i += 1
+                if len(query) > SEARCH_TERM_LENGTH and not (
+                    self.entries[(collection, document_id)][field].lower().startswith(query, offset)
+                ):
+                    continue
+                yield text, collection, document_id, field
+        for _, collection, document_id, field in heapq.merge(*(matches(c) for c in sorted(collections))):
+            yield (collection, document_id), field
+
+    def _substring_candidates(self, query, collections):
+        for collection in sorted(collections):
+            postings = sorted((self.grams[collection].get(g, set()) for g in trigrams(query)), key=len)
+            for document_id in postings[0]:
+                if all(document_id in other for other in postings[1:]):
+                    yield collection, document_id
+
+    def search(self, query, collections, limit):
+        query = query.strip().lower()
+        if not query:
+            return []
+        # Whole-field prefix, then word prefix, read in order off the sorted lists so only the
+        # results returned are visited; plain substrings come last, from the trigram index
+        results = {}
+        for starts in (self.field_starts, self.word_starts):
+            for key, field in self._prefix_matches(starts, query, collections):
+                if len(results) >= limit:
+                    break
+                results.setdefault(key, field)
+        if len(results) < limit and len(query) >= SEARCH_GRAM_SIZE:
+            substrings = []
+            for checked, key in enumerate(self._substring_candidates(query, collections)):
+                if len(results) + len(substrings) >= limit or checked >= SEARCH_SUBSTRING_SCAN_LIMIT:
+                    break
+                if key in results:
+                    continue
+                field = next((f for f, value in self.entries[key].items() if query in value.lower()), None)
+                if field is not None:
+                    substrings.append((key, field))
+            substrings.sort(key=lambda r: self.entries[r[0]][r[1]].lower())
+            results.update(substrings)
+        return [
+            {
+                "type": EVENT_ENTITIES[collection],
+                "id": document_id,
+                "matched_field": field,
+                "fields": self.entries[(collection, document_id)]
+            }
+            for (collection, document_id), field in list(results.items())[:limit]
+        ]
+
+search_index = SearchIndex(db)
+db.add_listener(search_index.on_change)
+
+# ============ DRIVER LEADERBOARD ============
+LEADERBOARD_METRICS = {
+    "completion_rate": driver_completion_rate,
+    "distance": lambda driver: driver.get("distance_driven", 0.0),
+    "safety_score": lambda driver: driver.get("safety_score", 0.0),
+}
+
+class DriverLeaderboard:
+    """Drivers kept sorted by each leaderboard metric, updated one driver at a time from change events."""
+
+    def __init__(self, database):
+        self.database = database
+        self.loaded = False
+        self.rankings = {metric: [] for metric in LEADERBOARD_METRICS}  # sorted (-value, id)
+        self.entries = {}  # driver id -> (driver, {metric: value})
+
+    def load(self):
+        self.entries.clear()
+        for ranking in self.rankings.values():
+            ranking.clear()
+        for driver in self.database.drivers._load():
+            self._add(driver, sort=False)
+        for ranking in self.rankings.values():
+            ranking.sort()
+        self.loaded = True
+
+    def on_change(self, collection, op, before, after):
+        if not self.loaded or collection != "drivers":
+            return
+        if before is not None:
+            self._remove(before["id"])
+        if after is not None:
+            self._add(after)
+
+    def _add(self, driver, sort=True):
+        values = {metric: value_of(driver) for metric, value_of in LEADERBOARD_METRICS.items()}
+        self.entries[driver["id"]] = (dict(driver), values)
+        for metric, value in values.items():
+            entry = (-value, driver["id"])
+            if sort:
+                bisect.insort(self.rankings[metric], entry)
+            else:
+                self.rankings[metric].append(entry)
+
+    def _remove(self, driver_id):
+        if driver_id not in self.entries:
+            return
+        _, values = self.entries.pop(driver_id)
+        for metric, value in values.items():
+            ranking = self.rankings[metric]
+            del ranking[bisect.bisect_left(ranking, (-value, driver_id))]
+
+    def top(self, metric, limit):
+        return [
+            {
+                "rank": rank,
+                "driver_id": driver_id,
+                "name": self.entries[driver_id][0]["name"],
+                "status": self.entries[driver_id][0].get("status"),
+                "value": -negated_value,
+                "trips_completed": self.entries[driver_id][0].get("trips_completed", 0),
+                "distance_driven": self.entries[driver_id][0].get("distance_driven", 0.0),
+            }
+            for rank, (negated_value, driver_id) in enumerate(self.rankings[metric][:limit], start=1)
+        ]
+
+driver_leaderboard = DriverLeaderboard(db)
+db.add_listener(driver_leaderboard.on_change)
+
+# ============ SNAPSHOTS ============
+# A snapshot holds the parsed documents of every loaded collection file together
+# with the derived structures built from them, so a restart can skip both the
+# JSON parsing and the index rebuilds. The pickle is signed with an HMAC keyed on
+# SECRET_KEY and the signature is checked before unpickling, so write access to
+# the data directory alone is not enough to get a snapshot loaded. Snapshots are
+# only restored by the exact code that wrote them (see CODE_FINGERPRINT), so a
+# changed index layout never gets restored from an old one.
+#
+# The default SECRET_KEY is public, so with it anyone who can write the data
+# directory could sign a snapshot: snapshots are neither written nor restored
+# until a SECRET_KEY is configured.
+SNAPSHOTS_ENABLED = SECRET_KEY != DEFAULT_SECRET_KEY
+SNAPSHOT_MAGIC = b"FLEETFLOW-SNAPSHOT"
+SNAPSHOT_PATH = data_dir / "snapshot.pickle"
+SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "300"))
+
+# Held for life by whichever worker took it first; only that worker writes snapshots
+snapshot_writer_lock = FileLock(f"{SNAPSHOT_PATH}.lock")
+
+DERIVED_STRUCTURES = {
+    "dispatch_index": dispatch_index,
+    "search_index": search_index,
+    "driver_leaderboard": driver_leaderboard,
+    "status_counters": status_counters,
+}
+
+def snapshot_key(collection_file):
+    return str(collection_file.file_path.relative_to(db.data_dir))
+
+def snapshot_signature(body):
+    return hmac.new(SECRET_KEY.encode(), body, hashlib.sha256).hexdigest().encode()
+
+def prepare_snapshot():
+    # Catch up with other workers first so documents and indexes describe the same state
+    db.refresh()
+    for structure in DERIVED_STRUCTURES.values():
+        if not structure.loaded:
+            structure.load()
+
+def dump_snapshot(path):
+    if not SNAPSHOTS_ENABLED:
+        raise RuntimeError("Snapshots need SECRET_KEY to be set")
+    state = {
+        "collections": {
+            snapshot_key(f): (f._version, f._data) for f in db.files() if f._data is not None
+        },
+        "derived": {
+            name: {k: v for k, v in vars(structure).items() if k != "database"}
+            for name, structure in DERIVED_STRUCTURES.items()
+        },
+    }
+    body = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    header = b" ".join([SNAPSHOT_MAGIC, CODE_FINGERPRINT.encode(), snapshot_signature(body)]) + b"\n"
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(header + body)
+    os.replace(tmp_path, path)
+
+def write_snapshot(path=SNAPSHOT_PATH):
+    prepare_snapshot()
+    dump_snapshot(path)
+
+async def write_snapshot_in_background(path=SNAPSHOT_PATH):
+    """Pickle from a forked child, which sees the store as of the fork while this worker keeps serving."""
+    if not hasattr(os, "fork"):
+        write_snapshot(path)
+        return
+    prepare_snapshot()
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 1
+        try:
+            # Signals meant for the server must not reach its event loop through the child
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            dump_snapshot(path)
+            exit_code = 0
+        finally:
+            os._exit(exit_code)
+    _, exit_status = await asyncio.to_thread(os.waitpid, pid, 0)
+    if exit_status:
+        raise RuntimeError(f"Snapshot writer exited with status {exit_status}")
+
+def claim_snapshot_writer():
+    """True if this worker is the one that writes snapshots, claiming the role if it is free."""
+    if not SNAPSHOTS_ENABLED:
+        return False
+    if not snapshot_writer_lock.is_locked:
+        try:
+            snapshot_writer_lock.acquire(timeout=0)
+        except Timeout:
+            return False
+    return True
+
+def restore_snapshot(path=SNAPSHOT_PATH):
+    if not SNAPSHOTS_ENABLED:
+        logging.getLogger(__name__).warning("Snapshots are disabled: SECRET_KEY is not set")
+        return False
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return False
+    header, _, body = raw.partition(b"\n")
+    magic, fingerprint, signature = (header.split(b" ") + [b"", b""])[:3]
+    if magic != SNAPSHOT_MAGIC or fingerprint != CODE_FINGERPRINT.encode():
+        logging.getLogger(__name__).info("Ignoring snapshot %s: written by other code", path)
+        return False
+    if not hmac.compare_digest(signature, snapshot_signature(body)):
+        logging.getLogger(__name__).warning("Ignoring snapshot %s: signature mismatch", path)
+        return False
+    state = pickle.loads(body)
+
+    files = {snapshot_key(f): f for f in db.files()}
+    # A file removed since the snapshot would leave its documents in the restored indexes
+    removed = sorted(set(state["collections"]) - set(files))
+    if removed:
+        logging.getLogger(__name__).warning("Ignoring snapshot %s: %s no longer on disk", path, ", ".join(removed))
+        return False
+    for key, (version, data) in state["collections"].items():
+        files[key]._data, files[key]._version = data, version
+    for name, structure in DERIVED_STRUCTURES.items():
+        vars(structure).update(state["derived"][name])
+
+    # Files created since the snapshot start out empty, so their documents replay as inserts
+    for f in files.values():
+        if f._data is None and f.listeners:
+            f._data, f._version = [], None
+    # Whatever changed on disk since the snapshot reaches the restored indexes as change events
+    db.refresh()
+    return True
+
+def warm_start():
+    started = time.perf_counter()
+    try:
+        restored = restore_snapshot()
+    except Exception:
+        logging.getLogger(__name__).exception("Snapshot restore failed, rebuilding")
+        restored = False
+    if not restored:
+        db.refresh()
+        for structure in DERIVED_STRUCTURES.values():
+            structure.load()
+    logging.getLogger(__name__).info(
+        "Store ready in %.3fs (%s), %.3fs after server import",
+        time.perf_counter() - started,
+        "restored from snapshot" if restored else "rebuilt from documents",
+        time.perf_counter() - SERVER_IMPORTED_AT
+    )
+
+async def snapshot_periodically():
+    written_versions = None
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL_SECONDS)
+        try:
+            if not claim_snapshot_writer():
+                continue
+            # Checked on disk so the archive is not pulled into memory just to compare
+            versions = [f._current_version() for f in db.files()]
+            if versions != written_versions:
+                await write_snapshot_in_background()
+                written_versions = versions
+        except Exception:
+            logging.getLogger(__name__).exception("Snapshot failed")
+
+def trip_was_dispatched(trip):
+    # Trips cancelled before dispatched_at was recorded count as never dispatched
+    return trip.get("status") in ACTIVE_TRIP_STATUSES + ["Completed"] or trip.get("dispatched_at") is not None
+
+def driver_trip_counters(trips):
+    """What a driver's trip counters add up to for the given trips, as kept by the trip routes."""
+    dispatched = [t for t in trips if trip_was_dispatched(t)]
+    completed = [t for t in dispatched if t.get("status") == "Completed"]
+    return {
+        "trips_assigned": len(trips),
+        "trips_dispatched": len(dispatched),
+        "trips_completed": len(completed),
+        "trips_cancelled": len([t for t in dispatched if t.get("status") == "Cancelled"]),
+        "total_trips": len(completed),
+        "distance_driven": sum(t.get("distance", 0) for t in completed),
+    }
+
+async def backfill_driver_stats():
+    """Derive trip counters once for drivers created before they were tracked."""
+    drivers = [d for d in db.drivers._load() if "trips_assigned" not in d]
+    if not drivers:
+        return
+    trips_by_driver = {}
+    for trip in await db.trips.find({}, {"_id": 0}, include_archived=True).to_list(None):
+        trips_by_driver.setdefault(trip.get("driver_id"), []).append(trip)
+    for driver in drivers:
+        await db.drivers.update_one(
+            {"id": driver["id"]}, {"$set": driver_trip_counters(trips_by_driver.get(driver["id"], []))}
+        )
+
 # ============ AUTH ROUTES ============
 @api_router.post("/auth/register")
 async def register(user_data: UserRegister):
@@ -399,20 +1636,29 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 
 # ============ DASHBOARD ROUTES ============
 @api_router.get("/dashboard/stats")
-async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
-    # Count vehicles by status
-    total_vehicles = await db.vehicles.count_documents({"out_of_service": False})
-    active_fleet = await db.vehicles.count_documents({"status": "On Trip"})
-    maintenance_alerts = await db.vehicles.count_documents({"status": "In Shop"})
-    ready_vehicles = await db.vehicles.count_documents({"status": "Ready"})
+async def get_dashboard_stats(request: Request, current_user: dict = Depends(get_current_user)):
+    return await versioned_response(
+        request, "dashboard-stats", [db.vehicles, db.trips, db.drivers], compute_dashboard_stats
+    )
+
+async def compute_dashboard_stats():
+    if not status_counters.loaded:
+        status_counters.load()
+    counts = status_counters.counts
+
+    # Vehicles by status
+    total_vehicles = counts["total_vehicles"]
+    active_fleet = counts["active_fleet"]
+    maintenance_alerts = counts["maintenance_alerts"]
+    ready_vehicles = counts["ready_vehicles"]
     
     # Trips
-    pending_cargo = await db.trips.count_documents({"status": "Draft"})
-    active_trips = await db.trips.count_documents({"status": {"$in": ["Dispatched", "In Progress"]}})
-    completed_trips = await db.trips.count_documents({"status": "Completed"})
+    pending_cargo = counts["pending_cargo"]
+    active_trips = counts["active_trips"]
+    completed_trips = counts["completed_trips"]
     
     # Drivers
-    active_drivers = await db.drivers.count_documents({"status": "On Duty"})
+    active_drivers = counts["active_drivers"]
     
     # Utilization rate
     utilization_rate = (active_fleet / total_vehicles * 100) if total_vehicles > 0 else 0
@@ -429,6 +1675,57 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
         "active_drivers": active_drivers
     }
 
+# ============ EVENT STREAM ROUTES ============
+@api_router.post("/events/token")
+async def create_event_stream_token(current_user: dict = Depends(get_current_user)):
+    return {
+        "token": create_access_token(
+            {"sub": current_user["id"], "scope": "events"}, timedelta(seconds=EVENT_STREAM_TOKEN_SECONDS)
+        )
+    }
+
+@api_router.get("/events/stream")
+async def stream_events(request: Request, token: str):
+    # EventSource cannot send an Authorization header, so a short-lived token from
+    # POST /events/token comes in the query instead of the session token
+    await get_user_from_token(token, scope="events")
+    # Sequences are per worker, so the stats the deltas apply to come from this
+    # worker too. Nothing awaits between subscribing and counting: the snapshot
+    # includes every event up to its id and none of those queued after it.
+    queue = event_broker.subscribe()
+    snapshot = event_broker.message("dashboard.stats", await compute_dashboard_stats())
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            yield snapshot
+            while not await request.is_disconnected():
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            event_broker.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ============ SEARCH ROUTES ============
+@api_router.get("/search")
+async def search(q: str, types: Optional[str] = None, limit: int = 20, current_user: dict = Depends(get_current_user)):
+    collections = set(SEARCH_FIELDS)
+    if types:
+        collections = {t.strip() for t in types.split(",") if t.strip()}
+        unknown = collections - set(SEARCH_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown search types: {', '.join(sorted(unknown))}")
+    if not search_index.loaded:
+        search_index.load()
+    return {"query": q, "results": search_index.search(q, collections, max(1, min(limit, 100)))}
+
 # ============ VEHICLE ROUTES ============
 @api_router.post("/vehicles", response_model=Vehicle)
 async def create_vehicle(vehicle_data: VehicleCreate, current_user: dict = Depends(get_current_user)):
@@ -442,9 +1739,11 @@ async def create_vehicle(vehicle_data: VehicleCreate, current_user: dict = Depen
     return vehicle
 
 @api_router.get("/vehicles", response_model=List[Vehicle])
-async def get_vehicles(current_user: dict = Depends(get_current_user)):
-    vehicles = await db.vehicles.find({}, {"_id": 0}).to_list(1000)
-    return vehicles
+async def get_vehicles(request: Request, current_user: dict = Depends(get_current_user)):
+    async def build():
+        vehicles = await db.vehicles.find({}, {"_id": 0}).to_list(1000)
+        return [Vehicle.model_validate(v).model_dump() for v in vehicles]
+    return await versioned_response(request, "vehicles", [db.vehicles], build)
 
 @api_router.get("/vehicles/{vehicle_id}", response_model=Vehicle)
 async def get_vehicle(vehicle_id: str, current_user: dict = Depends(get_current_user)):
@@ -493,6 +1792,14 @@ async def get_drivers(current_user: dict = Depends(get_current_user)):
     drivers = await db.drivers.find({}, {"_id": 0}).to_list(1000)
     return drivers
 
+@api_router.get("/drivers/leaderboard")
+async def get_driver_leaderboard(metric: str = "completion_rate", limit: int = 10, current_user: dict = Depends(get_current_user)):
+    if metric not in LEADERBOARD_METRICS:
+        raise HTTPException(status_code=400, detail=f"Metric must be one of: {', '.join(LEADERBOARD_METRICS)}")
+    if not driver_leaderboard.loaded:
+        driver_leaderboard.load()
+    return {"metric": metric, "drivers": driver_leaderboard.top(metric, max(1, min(limit, 100)))}
+
 @api_router.get("/drivers/{driver_id}", response_model=Driver)
 async def get_driver(driver_id: str, current_user: dict = Depends(get_current_user)):
     driver = await db.drivers.find_one({"id": driver_id}, {"_id": 0})
@@ -555,21 +1862,79 @@ async def create_trip(trip_data: TripCreate, current_user: dict = Depends(get_cu
         raise HTTPException(status_code=400, detail="Driver is suspended")
     
     # Check license expiry
-    expiry_date = datetime.fromisoformat(driver["license_expiry"].replace('Z', '+00:00'))
-    if expiry_date.tzinfo is None:
-        expiry_date = expiry_date.replace(tzinfo=timezone.utc)
-    if expiry_date < datetime.now(timezone.utc):
+    if license_expiry_date(driver) < datetime.now(timezone.utc):
         raise HTTPException(status_code=400, detail="Driver's license has expired")
     
     trip = Trip(**trip_data.model_dump())
     await db.trips.insert_one(trip.model_dump())
+    await db.drivers.update_one({"id": trip.driver_id}, {"$inc": {"trips_assigned": 1}})
     
     return trip
 
 @api_router.get("/trips", response_model=List[Trip])
-async def get_trips(current_user: dict = Depends(get_current_user)):
-    trips = await db.trips.find({}, {"_id": 0}).to_list(1000)
-    return trips
+async def get_trips(
+    request: Request,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    include_archived: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    query = date_range_query("created_at", start, end)
+    async def build():
+        trips = await db.trips.find(query, {"_id": 0}, include_archived=include_archived).to_list(1000)
+        return [Trip.model_validate(t).model_dump() for t in trips]
+    return await versioned_response(request, f"trips:{start}:{end}:{include_archived}", [db.trips], build)
+
+@api_router.post("/trips/dispatch-plan")
+async def plan_dispatch(plan_request: DispatchPlanRequest, current_user: dict = Depends(get_current_user)):
+    if not dispatch_index.loaded:
+        dispatch_index.load()
+
+    drafts = await db.trips.find({"status": "Draft"}, {"_id": 0}).to_list(None)
+    if plan_request.trip_ids is None:
+        trips = drafts
+    else:
+        requested = set(plan_request.trip_ids)
+        trips = [t for t in drafts if t["id"] in requested]
+        not_planned = requested - {t["id"] for t in trips}
+        if not_planned:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Only existing Draft trips can be planned: {', '.join(sorted(not_planned))}"
+            )
+
+    # Draft trips left out of the plan keep the vehicle and driver they were created with
+    planned = {t["id"] for t in trips}
+    held = [t for t in drafts if t["id"] not in planned]
+    plan = dispatch_index.plan(
+        trips,
+        datetime.now(timezone.utc),
+        held_vehicles={t["vehicle_id"] for t in held},
+        held_drivers={t["driver_id"] for t in held}
+    )
+
+    if plan_request.apply:
+        # One write per trip partition and one for the drivers, however many trips the plan covers
+        result = await db.trips.bulk_update([
+            (
+                {"id": assignment["trip_id"], "status": "Draft"},
+                {"$set": {"vehicle_id": assignment["vehicle_id"], "driver_id": assignment["driver_id"]}}
+            )
+            for assignment in plan["assignments"]
+        ])
+        previous_drivers = {t["id"]: t["driver_id"] for t in trips}
+        assigned_changes = {}
+        for assignment, applied in zip(plan["assignments"], result.modified):
+            previous_driver = previous_drivers[assignment["trip_id"]]
+            if applied and previous_driver != assignment["driver_id"]:
+                assigned_changes[previous_driver] = assigned_changes.get(previous_driver, 0) - 1
+                assigned_changes[assignment["driver_id"]] = assigned_changes.get(assignment["driver_id"], 0) + 1
+        await db.drivers.bulk_update([
+            ({"id": driver_id}, {"$inc": {"trips_assigned": change}})
+            for driver_id, change in assigned_changes.items() if change
+        ])
+
+    return plan
 
 @api_router.get("/trips/{trip_id}", response_model=Trip)
 async def get_trip(trip_id: str, current_user: dict = Depends(get_current_user)):
@@ -584,14 +1949,23 @@ async def dispatch_trip(trip_id: str, current_user: dict = Depends(get_current_u
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     
-    # Update trip status
-    await db.trips.update_one({"id": trip_id}, {"$set": {"status": "Dispatched"}})
+    # Update trip status; checking it in the same write lets only one concurrent request through
+    result = await db.trips.update_one(
+        {"id": trip_id, "status": "Draft"},
+        {"$set": {"status": "Dispatched", "dispatched_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    if not result.modified_count:
+        raise HTTPException(status_code=400, detail="Only Draft trips can be dispatched")
+    trip = await db.trips.find_one({"id": trip_id}) or trip
     
     # Update vehicle status
     await db.vehicles.update_one({"id": trip["vehicle_id"]}, {"$set": {"status": "On Trip"}})
     
-    # Update driver status
-    await db.drivers.update_one({"id": trip["driver_id"]}, {"$set": {"status": "On Duty"}})
+    # Update driver status and stats
+    await db.drivers.update_one(
+        {"id": trip["driver_id"]},
+        {"$set": {"status": "On Duty"}, "$inc": {"trips_dispatched": 1}}
+    )
     
     return {"message": "Trip dispatched"}
 
@@ -601,29 +1975,28 @@ async def complete_trip(trip_id: str, current_user: dict = Depends(get_current_u
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     
-    # Update trip status
-    await db.trips.update_one(
-        {"id": trip_id}, 
+    # Update trip status; checking it in the same write lets only one concurrent request through
+    result = await db.trips.update_one(
+        {"id": trip_id, "status": {"$in": ACTIVE_TRIP_STATUSES}}, 
         {"$set": {
             "status": "Completed",
             "completed_at": datetime.now(timezone.utc).isoformat()
         }}
     )
+    if not result.modified_count:
+        raise HTTPException(status_code=400, detail="Only dispatched trips can be completed")
+    trip = await db.trips.find_one({"id": trip_id}) or trip
     
     # Update vehicle status back to Ready
     await db.vehicles.update_one({"id": trip["vehicle_id"]}, {"$set": {"status": "Ready"}})
     
     # Update driver stats
-    driver = await db.drivers.find_one({"id": trip["driver_id"]})
-    total_trips = driver.get("total_trips", 0) + 1
-    completion_rate = 100.0  # Simplified - in real app, track completed vs total
-    
     await db.drivers.update_one(
         {"id": trip["driver_id"]}, 
-        {"$set": {
-            "status": "Off Duty",
-            "total_trips": total_trips,
-            "trip_completion_rate": completion_rate
+        {"$set": {"status": "Off Duty"}, "$inc": {
+            "total_trips": 1,
+            "trips_completed": 1,
+            "distance_driven": trip.get("distance", 0)
         }}
     )
     
@@ -635,20 +2008,43 @@ async def cancel_trip(trip_id: str, current_user: dict = Depends(get_current_use
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     
-    await db.trips.update_one({"id": trip_id}, {"$set": {"status": "Cancelled"}})
+    # Trips only move forward, so trying Draft before the active statuses cannot miss a
+    # trip that is dispatched in between; each attempt checks the status in the same write
+    was_active = False
+    result = await db.trips.update_one({"id": trip_id, "status": "Draft"}, {"$set": {"status": "Cancelled"}})
+    if not result.modified_count:
+        was_active = True
+        result = await db.trips.update_one(
+            {"id": trip_id, "status": {"$in": ACTIVE_TRIP_STATUSES}}, {"$set": {"status": "Cancelled"}}
+        )
+    current = await db.trips.find_one({"id": trip_id}) or trip
+    if not result.modified_count:
+        raise HTTPException(status_code=400, detail=f"Trip is already {current['status'].lower()}")
+    trip = current
     
-    # Reset vehicle and driver status if trip was dispatched
-    if trip["status"] == "Dispatched":
+    # Reset vehicle and driver status if trip was dispatched; only then does it count against the driver
+    if was_active:
         await db.vehicles.update_one({"id": trip["vehicle_id"]}, {"$set": {"status": "Ready"}})
-        await db.drivers.update_one({"id": trip["driver_id"]}, {"$set": {"status": "Off Duty"}})
+        await db.drivers.update_one(
+            {"id": trip["driver_id"]},
+            {"$set": {"status": "Off Duty"}, "$inc": {"trips_cancelled": 1}}
+        )
     
     return {"message": "Trip cancelled"}
 
 @api_router.delete("/trips/{trip_id}")
 async def delete_trip(trip_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.trips.delete_one({"id": trip_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Trip not found")
+    while True:
+        trip = await db.trips.find_one({"id": trip_id})
+        if not trip:
+            raise HTTPException(status_code=404, detail="Trip not found")
+        # Only delete the trip as read, so the counters taken back below are the ones it added
+        result = await db.trips.delete_one({"id": trip_id, "status": trip["status"], "driver_id": trip["driver_id"]})
+        if result.deleted_count:
+            break
+    
+    counters = driver_trip_counters([trip])
+    await db.drivers.update_one({"id": trip["driver_id"]}, {"$inc": {k: -v for k, v in counters.items()}})
     return {"message": "Trip deleted"}
 
 # ============ MAINTENANCE ROUTES ============
@@ -667,8 +2063,8 @@ async def create_maintenance_log(log_data: MaintenanceLogCreate, current_user: d
     return log
 
 @api_router.get("/maintenance", response_model=List[MaintenanceLog])
-async def get_maintenance_logs(current_user: dict = Depends(get_current_user)):
-    logs = await db.maintenance_logs.find({}, {"_id": 0}).to_list(1000)
+async def get_maintenance_logs(start: Optional[str] = None, end: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    logs = await db.maintenance_logs.find(date_range_query("service_date", start, end), {"_id": 0}).to_list(1000)
     return logs
 
 @api_router.delete("/maintenance/{log_id}")
@@ -691,8 +2087,8 @@ async def create_fuel_log(log_data: FuelLogCreate, current_user: dict = Depends(
     return log
 
 @api_router.get("/fuel-logs", response_model=List[FuelLog])
-async def get_fuel_logs(current_user: dict = Depends(get_current_user)):
-    logs = await db.fuel_logs.find({}, {"_id": 0}).to_list(1000)
+async def get_fuel_logs(start: Optional[str] = None, end: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    logs = await db.fuel_logs.find(date_range_query("date", start, end), {"_id": 0}).to_list(1000)
     return logs
 
 @api_router.delete("/fuel-logs/{log_id}")
@@ -715,8 +2111,8 @@ async def create_expense_log(log_data: ExpenseLogCreate, current_user: dict = De
     return log
 
 @api_router.get("/expense-logs", response_model=List[ExpenseLog])
-async def get_expense_logs(current_user: dict = Depends(get_current_user)):
-    logs = await db.expense_logs.find({}, {"_id": 0}).to_list(1000)
+async def get_expense_logs(start: Optional[str] = None, end: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    logs = await db.expense_logs.find(date_range_query("date", start, end), {"_id": 0}).to_list(1000)
     return logs
 
 @api_router.delete("/expense-logs/{log_id}")
@@ -728,29 +2124,57 @@ async def delete_expense_log(log_id: str, current_user: dict = Depends(get_curre
 
 # ============ ANALYTICS ROUTES ============
 @api_router.get("/analytics/vehicle-costs")
-async def get_vehicle_costs(current_user: dict = Depends(get_current_user)):
+async def get_vehicle_costs(
+    request: Request,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    return await versioned_response(
+        request,
+        f"vehicle-costs:{start}:{end}",
+        [db.vehicles, db.maintenance_logs, db.fuel_logs, db.expense_logs, db.trips],
+        lambda: compute_vehicle_costs(start, end)
+    )
+
+def sum_by_vehicle(documents, field):
+    totals = {}
+    for document in documents:
+        totals[document["vehicle_id"]] = totals.get(document["vehicle_id"], 0) + document[field]
+    return totals
+
+async def compute_vehicle_costs(start: Optional[str] = None, end: Optional[str] = None):
     vehicles = await db.vehicles.find({}, {"_id": 0}).to_list(1000)
+
+    # One pass per collection, limited to the months in range, then grouped by vehicle
+    maintenance_logs = await db.maintenance_logs.find(date_range_query("service_date", start, end), {"_id": 0}).to_list(None)
+    fuel_logs = await db.fuel_logs.find(date_range_query("date", start, end), {"_id": 0}).to_list(None)
+    expense_logs = await db.expense_logs.find(date_range_query("date", start, end), {"_id": 0}).to_list(None)
+    trips = await db.trips.find(
+        {"status": "Completed", **date_range_query("created_at", start, end)}, {"_id": 0}, include_archived=True
+    ).to_list(None)
+
+    maintenance_costs = sum_by_vehicle(maintenance_logs, "cost")
+    fuel_costs = sum_by_vehicle(fuel_logs, "cost")
+    fuel_liters = sum_by_vehicle(fuel_logs, "liters")
+    other_expense_totals = sum_by_vehicle(expense_logs, "amount")
+    trip_counts = {}
+    trip_distances = {}
+    for trip in trips:
+        trip_counts[trip["vehicle_id"]] = trip_counts.get(trip["vehicle_id"], 0) + 1
+        trip_distances[trip["vehicle_id"]] = trip_distances.get(trip["vehicle_id"], 0) + trip.get("distance", 0)
     
     result = []
     for vehicle in vehicles:
-        # Get maintenance costs
-        maintenance_logs = await db.maintenance_logs.find({"vehicle_id": vehicle["id"]}, {"_id": 0}).to_list(1000)
-        maintenance_cost = sum(log["cost"] for log in maintenance_logs)
-        
-        # Get fuel costs
-        fuel_logs = await db.fuel_logs.find({"vehicle_id": vehicle["id"]}, {"_id": 0}).to_list(1000)
-        fuel_cost = sum(log["cost"] for log in fuel_logs)
-        total_liters = sum(log["liters"] for log in fuel_logs)
-        
-        # Get other expenses
-        expense_logs = await db.expense_logs.find({"vehicle_id": vehicle["id"]}, {"_id": 0}).to_list(1000)
-        other_expenses = sum(log["amount"] for log in expense_logs)
+        maintenance_cost = maintenance_costs.get(vehicle["id"], 0)
+        fuel_cost = fuel_costs.get(vehicle["id"], 0)
+        total_liters = fuel_liters.get(vehicle["id"], 0)
+        other_expenses = other_expense_totals.get(vehicle["id"], 0)
         
         total_cost = maintenance_cost + fuel_cost + other_expenses
         
         # Calculate fuel efficiency (simplified)
-        trips = await db.trips.find({"vehicle_id": vehicle["id"], "status": "Completed"}, {"_id": 0}).to_list(1000)
-        total_distance = sum(trip.get("distance", 0) for trip in trips)
+        total_distance = trip_distances.get(vehicle["id"], 0)
         fuel_efficiency = (total_distance / total_liters) if total_liters > 0 else 0
         
         result.append({
@@ -763,14 +2187,25 @@ async def get_vehicle_costs(current_user: dict = Depends(get_current_user)):
             "total_cost": round(total_cost, 2),
             "total_distance": round(total_distance, 2),
             "fuel_efficiency": round(fuel_efficiency, 2),
-            "total_trips": len(trips)
+            "total_trips": trip_counts.get(vehicle["id"], 0)
         })
     
     return result
 
 @api_router.get("/analytics/fuel-trends")
-async def get_fuel_trends(current_user: dict = Depends(get_current_user)):
-    fuel_logs = await db.fuel_logs.find({}, {"_id": 0}).sort("date", 1).to_list(1000)
+async def get_fuel_trends(
+    request: Request,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    query = date_range_query("date", start, end)
+    return await versioned_response(
+        request, f"fuel-trends:{start}:{end}", [db.fuel_logs], lambda: compute_fuel_trends(query)
+    )
+
+async def compute_fuel_trends(query=None):
+    fuel_logs = await db.fuel_logs.find(query or {}, {"_id": 0}).sort("date", 1).to_list(1000)
     
     # Group by date
     date_groups = {}
@@ -808,16 +2243,16 @@ async def export_report(report_type: str, current_user: dict = Depends(get_curre
         drivers = await db.drivers.find({}, {"_id": 0}).to_list(1000)
         writer.writerow(["ID", "Name", "License Number", "License Expiry", "Phone", "Status", "Safety Score", "Completion Rate", "Total Trips"])
         for d in drivers:
-            writer.writerow([d["id"], d["name"], d["license_number"], d["license_expiry"], d["phone"], d["status"], d["safety_score"], d["trip_completion_rate"], d["total_trips"]])
+            writer.writerow([d["id"], d["name"], d["license_number"], d["license_expiry"], d["phone"], d["status"], d["safety_score"], driver_completion_rate(d), d["total_trips"]])
     
     elif report_type == "trips":
-        trips = await db.trips.find({}, {"_id": 0}).to_list(1000)
+        trips = await db.trips.find({}, {"_id": 0}, include_archived=True).to_list(1000)
         writer.writerow(["ID", "Origin", "Destination", "Cargo Weight", "Vehicle ID", "Driver ID", "Status", "Distance", "Created At"])
         for t in trips:
             writer.writerow([t["id"], t["origin"], t["destination"], t["cargo_weight"], t["vehicle_id"], t["driver_id"], t["status"], t.get("distance", 0), t["created_at"]])
     
     elif report_type == "costs":
-        costs = await get_vehicle_costs(current_user)
+        costs = await compute_vehicle_costs()
         writer.writerow(["Vehicle ID", "Vehicle Name", "License Plate", "Maintenance Cost", "Fuel Cost", "Other Expenses", "Total Cost", "Total Distance", "Fuel Efficiency", "Total Trips"])
         for c in costs:
             writer.writerow([c["vehicle_id"], c["vehicle_name"], c["license_plate"], c["maintenance_cost"], c["fuel_cost"], c["other_expenses"], c["total_cost"], c["total_distance"], c["fuel_efficiency"], c["total_trips"]])
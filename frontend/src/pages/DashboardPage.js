@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import Layout from '@/components/Layout';
 import { Truck, AlertTriangle, Activity, Package, TrendingUp, Users } from 'lucide-react';
@@ -9,14 +9,80 @@ const DashboardPage = () => {
   const [stats, setStats] = useState(null);
   const [loading, setLoading] = useState(true);
 
+  // Id of the stream event the current stats include; null until the stream sent them
+  const sequenceRef = useRef(null);
+
   useEffect(() => {
     fetchStats();
+
+    if (!localStorage.getItem('token')) return undefined;
+
+    let source;
+    let retryTimer;
+    let closed = false;
+    const reconnect = () => {
+      if (source) source.close();
+      retryTimer = setTimeout(connect, 3000);
+    };
+    const connect = async () => {
+      sequenceRef.current = null;
+      let token;
+      try {
+        // Only this short-lived token goes into the URL, never the session token
+        const response = await axios.post(`${API}/events/token`);
+        token = response.data.token;
+      } catch (error) {
+        console.error('Failed to open event stream:', error);
+        if (!closed) reconnect();
+        return;
+      }
+      if (closed) return;
+      source = new EventSource(`${API}/events/stream?token=${encodeURIComponent(token)}`);
+      // The browser would retry with the same token, which expires within a minute
+      source.onerror = reconnect;
+      // Sent first on every (re)connect: the totals as of the event id it carries
+      source.addEventListener('dashboard.stats', (event) => {
+        sequenceRef.current = Number(event.lastEventId);
+        setStats(JSON.parse(event.data));
+        setLoading(false);
+      });
+      source.addEventListener('dashboard.delta', (event) => {
+        // Deltas already counted in the stats, or arriving before them, would count twice or be lost
+        if (sequenceRef.current === null || Number(event.lastEventId) <= sequenceRef.current) return;
+        sequenceRef.current = Number(event.lastEventId);
+        const delta = JSON.parse(event.data);
+        setStats((prev) => {
+          if (!prev) return prev;
+          const next = { ...prev };
+          Object.entries(delta).forEach(([key, change]) => {
+            next[key] = (next[key] || 0) + change;
+          });
+          next.utilization_rate = next.total_vehicles > 0
+            ? Math.round((next.active_fleet / next.total_vehicles) * 1000) / 10
+            : 0;
+          return next;
+        });
+      });
+      // The server dropped events for this client: start over from fresh stats
+      source.addEventListener('resync', () => {
+        source.close();
+        connect();
+      });
+    };
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      if (source) source.close();
+    };
   }, []);
 
   const fetchStats = async () => {
     try {
       const response = await axios.get(`${API}/dashboard/stats`);
-      setStats(response.data);
+      // Stats from the stream are newer, and the deltas since then are applied to them
+      if (sequenceRef.current === null) setStats(response.data);
     } catch (error) {
       console.error('Failed to fetch stats:', error);
     } finally {
@@ -0,0 +1,14 @@
+import sys
+
+import pytest
+
+from .helpers import load_server
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    # Snapshots are disabled under the default key
+    monkeypatch.setenv("SECRET_KEY", "test-secret-key-for-signing-tokens-and-snapshots")
+    module = load_server(tmp_path, monkeypatch)
+    yield module
+    sys.modules.pop("server", None)
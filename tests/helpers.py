@@ -0,0 +1,75 @@
+"""Shared helpers for tests that run backend/server.py against a temporary data directory."""
+import importlib
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+
+def load_server(data_dir, monkeypatch):
+    """Import a fresh copy of the server module backed by data_dir, as a newly started worker would."""
+    monkeypatch.setenv("DATA_DIR", str(data_dir))
+    monkeypatch.syspath_prepend(str(BACKEND_DIR))
+    sys.modules.pop("server", None)
+    return importlib.import_module("server")
+
+
+def start_worker(data_dir, code, *args):
+    """Run code in another process, with `server` imported against the same data_dir."""
+    script = "import asyncio\nimport sys\nimport server\n" + textwrap.dedent(code)
+    return subprocess.Popen(
+        [sys.executable, "-c", script, *args],
+        cwd=BACKEND_DIR,
+        env={**os.environ, "DATA_DIR": str(data_dir)},
+    )
+
+
+def run_worker(data_dir, code):
+    assert start_worker(data_dir, code).wait(timeout=120) == 0
+
+
+def trip(trip_id, created_at, status="Draft", **fields):
+    return {
+        "id": trip_id,
+        "origin": "Lyon",
+        "destination": "Paris",
+        "cargo_weight": 100.0,
+        "cargo_description": "crates",
+        "vehicle_id": "v1",
+        "driver_id": "d1",
+        "status": status,
+        "distance": 10.0,
+        "created_at": created_at,
+        "completed_at": None,
+        **fields,
+    }
+
+
+def vehicle(vehicle_id, max_capacity=800.0, **fields):
+    return {
+        "id": vehicle_id, "name": f"Van {vehicle_id}", "model": "Transit", "license_plate": f"PL-{vehicle_id}",
+        "vehicle_type": "Van", "max_capacity": max_capacity, "odometer": 0.0, "status": "Ready",
+        "out_of_service": False, **fields,
+    }
+
+
+def driver(driver_id, safety_score=90.0, **fields):
+    return {
+        "id": driver_id, "name": f"Driver {driver_id}", "license_number": f"L-{driver_id}",
+        "license_expiry": "2030-01-01", "phone": "555-0101", "status": "Off Duty",
+        "safety_score": safety_score, **fields,
+    }
+
+
+def derived_state(structure):
+    return {k: v for k, v in vars(structure).items() if k != "database"}
+
+
+def assert_derived_match_rebuild(server):
+    for name, structure in server.DERIVED_STRUCTURES.items():
+        rebuilt = type(structure)(server.db)
+        rebuilt.load()
+        assert derived_state(structure) == derived_state(rebuilt), name
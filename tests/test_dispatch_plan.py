@@ -0,0 +1,123 @@
+"""Batch dispatch planning (POST /api/trips/dispatch-plan)."""
+import asyncio
+import json
+from collections import Counter
+
+from .helpers import assert_derived_match_rebuild, driver, trip, vehicle
+
+
+def plan(server, trip_ids=None, apply=False):
+    request = server.DispatchPlanRequest(trip_ids=trip_ids, apply=apply)
+    return asyncio.run(server.plan_dispatch(request, {}))
+
+
+async def insert(server, vehicles=(), drivers=(), trips=()):
+    for document in vehicles:
+        await server.db.vehicles.insert_one(document)
+    for document in drivers:
+        await server.db.drivers.insert_one(document)
+    for document in trips:
+        await server.db.trips.insert_one(document)
+
+
+def test_heaviest_cargo_goes_on_the_smallest_vehicle_that_holds_it(server):
+    asyncio.run(insert(
+        server,
+        vehicles=[vehicle("small", 100.0), vehicle("medium", 300.0), vehicle("large", 500.0)],
+        drivers=[driver("careful", 99.0), driver("average", 80.0), driver("reckless", 40.0)],
+        trips=[
+            trip("light", "2026-05-01T08:00:00+00:00", cargo_weight=90.0),
+            trip("middle", "2026-05-01T08:00:00+00:00", cargo_weight=250.0),
+            trip("heavy", "2026-05-01T08:00:00+00:00", cargo_weight=480.0),
+        ],
+    ))
+
+    result = plan(server)
+
+    assert [(a["trip_id"], a["vehicle_id"], a["driver_id"]) for a in result["assignments"]] == [
+        ("heavy", "large", "careful"),
+        ("middle", "medium", "average"),
+        ("light", "small", "reckless"),
+    ]
+    assert result["unassigned"] == []
+    assert result["total_spare_capacity"] == 80.0
+
+
+def test_trips_without_a_vehicle_or_driver_are_reported_unassigned(server):
+    asyncio.run(insert(
+        server,
+        vehicles=[vehicle("small", 100.0), vehicle("medium", 300.0)],
+        drivers=[driver("only")],
+        trips=[
+            trip("too-heavy", "2026-05-01T08:00:00+00:00", cargo_weight=900.0),
+            trip("first", "2026-05-01T08:00:00+00:00", cargo_weight=200.0),
+            trip("second", "2026-05-01T08:00:00+00:00", cargo_weight=50.0),
+        ],
+    ))
+
+    result = plan(server)
+
+    assert [a["trip_id"] for a in result["assignments"]] == ["first"]
+    assert result["unassigned"] == [
+        {"trip_id": "too-heavy", "reason": "No Ready vehicle with enough capacity"},
+        {"trip_id": "second", "reason": "No eligible driver available"},
+    ]
+
+
+def test_vehicles_and_drivers_of_unplanned_drafts_are_held(server):
+    asyncio.run(insert(
+        server,
+        vehicles=[vehicle("held", 100.0), vehicle("free", 500.0)],
+        drivers=[driver("held-driver", 99.0), driver("free-driver", 50.0)],
+        trips=[
+            trip("kept", "2026-05-01T08:00:00+00:00", vehicle_id="held", driver_id="held-driver", cargo_weight=50.0),
+            trip("planned", "2026-05-01T08:00:00+00:00", vehicle_id="free", driver_id="free-driver", cargo_weight=50.0),
+        ],
+    ))
+
+    result = plan(server, trip_ids=["planned"], apply=True)
+
+    assert [(a["vehicle_id"], a["driver_id"]) for a in result["assignments"]] == [("free", "free-driver")]
+    kept = asyncio.run(server.db.trips.find_one({"id": "kept"}))
+    assert (kept["vehicle_id"], kept["driver_id"]) == ("held", "held-driver")
+
+
+def test_applying_a_large_plan_writes_each_file_once(server, tmp_path, monkeypatch):
+    count = 3000
+    months = ["2026-05", "2026-06"]
+    # Written straight to disk: inserting one by one would rewrite the files thousands of times
+    (tmp_path / "vehicles.json").write_text(json.dumps([vehicle(f"v{i}", 100.0 + i) for i in range(count)]))
+    # Trips start out shared between a third of the drivers, so the plan moves assignments around
+    (tmp_path / "drivers.json").write_text(json.dumps([
+        driver(f"d{i}", safety_score=float(i % 100), trips_assigned=3 if i < count // 3 else 0) for i in range(count)
+    ]))
+    for month in months:
+        (tmp_path / "trips" / f"{month}.json").write_text(json.dumps([
+            trip(f"t{i}", f"{month}-10T08:00:00+00:00", vehicle_id=f"v{i}", driver_id=f"d{i % (count // 3)}", cargo_weight=float(i % 500))
+            for i in range(count) if months[i % 2] == month
+        ]))
+    server.warm_start()
+
+    saves = Counter()
+    original_save = server.JSONCollection._save
+
+    def counting_save(collection, data):
+        saves[collection.file_path.relative_to(tmp_path).as_posix()] += 1
+        return original_save(collection, data)
+
+    monkeypatch.setattr(server.JSONCollection, "_save", counting_save)
+    result = plan(server, apply=True)
+
+    assert len(result["assignments"]) == count
+    assert saves == {"trips/2026-05.json": 1, "trips/2026-06.json": 1, "drivers.json": 1}
+
+    trips = asyncio.run(server.db.trips.find({}).to_list(None))
+    capacities = {v["id"]: v["max_capacity"] for v in asyncio.run(server.db.vehicles.find({}).to_list(None))}
+    assert len({t["vehicle_id"] for t in trips}) == len({t["driver_id"] for t in trips}) == count
+    assert all(t["cargo_weight"] <= capacities[t["vehicle_id"]] for t in trips)
+
+    assigned = Counter(t["driver_id"] for t in trips)
+    drivers = asyncio.run(server.db.drivers.find({}).to_list(None))
+    assert all(d["trips_assigned"] == assigned[d["id"]] for d in drivers)
+    # Every rewritten trip still reached the listeners as its own change event
+    assert_derived_match_rebuild(server)
@@ -0,0 +1,112 @@
+"""Trip counters kept on drivers as their trips are dispatched, completed, cancelled and deleted."""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from .helpers import vehicle
+
+COUNTERS = ["trips_assigned", "trips_dispatched", "trips_completed", "trips_cancelled", "total_trips", "distance_driven"]
+
+
+async def setup(server, vehicles=3):
+    for i in range(vehicles):
+        await server.db.vehicles.insert_one(vehicle(f"v{i}"))
+    created = await server.create_driver(
+        server.DriverCreate(name="Dana", license_number="L-1", license_expiry="2030-01-01", phone="555-0101"), {}
+    )
+    return created.id
+
+
+async def create_trip(server, driver_id, vehicle_id, distance):
+    request = server.TripCreate(
+        origin="Lyon", destination="Paris", cargo_weight=100.0,
+        vehicle_id=vehicle_id, driver_id=driver_id, distance=distance,
+    )
+    return (await server.create_trip(request, {})).id
+
+
+async def counters(server, driver_id):
+    driver = await server.db.drivers.find_one({"id": driver_id})
+    return {name: driver.get(name) for name in COUNTERS}
+
+
+async def rebuilt_counters(server, driver_id):
+    trips = await server.db.trips.find({"driver_id": driver_id}, include_archived=True).to_list(None)
+    return server.driver_trip_counters(trips)
+
+
+def test_dispatch_and_completion_count_towards_the_driver(server):
+    async def main():
+        driver_id = await setup(server)
+        completed = await create_trip(server, driver_id, "v0", 120.0)
+        await create_trip(server, driver_id, "v1", 40.0)
+        await server.dispatch_trip(completed, {})
+        await server.complete_trip(completed, {})
+
+        assert await counters(server, driver_id) == {
+            "trips_assigned": 2, "trips_dispatched": 1, "trips_completed": 1, "trips_cancelled": 0,
+            "total_trips": 1, "distance_driven": 120.0,
+        }
+        assert await counters(server, driver_id) == await rebuilt_counters(server, driver_id)
+
+    asyncio.run(main())
+
+
+def test_only_cancelling_a_dispatched_trip_counts_against_the_driver(server):
+    async def main():
+        driver_id = await setup(server)
+        draft, dispatched, completed = [await create_trip(server, driver_id, f"v{i}", 10.0) for i in range(3)]
+        await server.cancel_trip(draft, {})
+        for trip_id in (dispatched, completed):
+            await server.dispatch_trip(trip_id, {})
+        await server.cancel_trip(dispatched, {})
+        await server.complete_trip(completed, {})
+        with pytest.raises(HTTPException):
+            await server.cancel_trip(dispatched, {})
+
+        driver = await server.db.drivers.find_one({"id": driver_id})
+        assert (driver["trips_dispatched"], driver["trips_cancelled"], driver["trips_completed"]) == (2, 1, 1)
+        assert server.driver_completion_rate(driver) == 50.0
+        assert await counters(server, driver_id) == await rebuilt_counters(server, driver_id)
+
+    asyncio.run(main())
+
+
+def test_deleting_trips_takes_back_what_they_added(server):
+    async def main():
+        driver_id = await setup(server)
+        trip_ids = [await create_trip(server, driver_id, f"v{i}", 25.0) for i in range(3)]
+        for trip_id in trip_ids[1:]:
+            await server.dispatch_trip(trip_id, {})
+        await server.complete_trip(trip_ids[1], {})
+        await server.cancel_trip(trip_ids[2], {})
+
+        await server.delete_trip(trip_ids[1], {})
+        assert await counters(server, driver_id) == await rebuilt_counters(server, driver_id)
+        for trip_id in (trip_ids[0], trip_ids[2]):
+            await server.delete_trip(trip_id, {})
+        assert await counters(server, driver_id) == {name: 0 for name in COUNTERS}
+
+    asyncio.run(main())
+
+
+def test_backfill_derives_the_counters_the_endpoints_maintain(server):
+    async def main():
+        driver_id = await setup(server)
+        trip_ids = [await create_trip(server, driver_id, f"v{i}", 30.0) for i in range(3)]
+        for trip_id in trip_ids[:2]:
+            await server.dispatch_trip(trip_id, {})
+        await server.complete_trip(trip_ids[0], {})
+        await server.cancel_trip(trip_ids[1], {})
+        maintained = await counters(server, driver_id)
+
+        # As stored before the counters were tracked
+        driver = await server.db.drivers.find_one({"id": driver_id})
+        await server.db.drivers.delete_one({"id": driver_id})
+        await server.db.drivers.insert_one({k: v for k, v in driver.items() if k not in COUNTERS})
+        await server.backfill_driver_stats()
+
+        assert await counters(server, driver_id) == maintained
+
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+"""Dashboard stats and deltas on the event stream (GET /api/events/stream)."""
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from .helpers import trip, vehicle
+
+
+class ConnectedRequest:
+    async def is_disconnected(self):
+        return False
+
+
+def parse(message):
+    fields = dict(line.split(": ", 1) for line in message.strip().splitlines())
+    return int(fields["id"]), fields["event"], json.loads(fields["data"])
+
+
+def test_stats_snapshot_carries_the_sequence_the_deltas_continue_from(server):
+    async def main():
+        await server.db.users.insert_one({"id": "u1", "email": "u1@example.com"})
+        await server.db.vehicles.insert_one(vehicle("v1"))
+        token = (await server.create_event_stream_token({"id": "u1"}))["token"]
+
+        response = await server.stream_events(ConnectedRequest(), token)
+        stream = response.body_iterator
+        assert await anext(stream) == "retry: 3000\n\n"
+        snapshot_id, event, stats = parse(await anext(stream))
+        assert (snapshot_id, event) == (server.event_broker.sequence, "dashboard.stats")
+        assert stats["total_vehicles"] == 1 and stats["pending_cargo"] == 0
+
+        await server.db.trips.insert_one(trip("t1", "2026-05-01T08:00:00+00:00"))
+        events = [parse(await anext(stream)) for _ in range(2)]
+        assert [(event, data.get("pending_cargo")) for _, event, data in events] == [
+            ("trip.created", None), ("dashboard.delta", 1)
+        ]
+        assert all(event_id > snapshot_id for event_id, _, _ in events)
+        await stream.aclose()
+
+    asyncio.run(main())
+
+
+def test_stream_takes_only_short_lived_stream_tokens(server):
+    async def main():
+        await server.db.users.insert_one({"id": "u1", "email": "u1@example.com"})
+        session_token = server.create_access_token({"sub": "u1"})
+        stream_token = (await server.create_event_stream_token({"id": "u1"}))["token"]
+
+        with pytest.raises(HTTPException):
+            await server.stream_events(ConnectedRequest(), session_token)
+        with pytest.raises(HTTPException):
+            await server.get_user_from_token(stream_token)
+        assert (await server.get_user_from_token(stream_token, scope="events"))["id"] == "u1"
+
+    asyncio.run(main())
+    expiry = server.jwt.decode(
+        asyncio.run(server.create_event_stream_token({"id": "u1"}))["token"], options={"verify_signature": False}
+    )["exp"]
+    assert expiry - server.datetime.now(server.timezone.utc).timestamp() <= server.EVENT_STREAM_TOKEN_SECONDS
@@ -0,0 +1,141 @@
+"""Behaviour of the JSON store in backend/server.py when several worker processes share it."""
+import asyncio
+
+import pytest
+
+from .helpers import assert_derived_match_rebuild, driver, load_server, run_worker, start_worker, trip, vehicle
+
+
+async def seed(server):
+    await server.db.vehicles.insert_one(vehicle("v1"))
+    await server.db.drivers.insert_one(driver("d1"))
+    await server.db.trips.insert_one(trip("t-feb", "2026-02-10T08:00:00+00:00", "Completed"))
+    await server.db.trips.insert_one(trip("t-mar", "2026-03-05T08:00:00+00:00"))
+
+
+def test_concurrent_inserts_from_two_processes_are_all_kept(server, tmp_path):
+    code = """
+    async def main(prefix):
+        for i in range(40):
+            await server.db.vehicles.insert_one({"id": f"{prefix}-v{i}", "name": "Van"})
+            await server.db.trips.insert_one({"id": f"{prefix}-t{i}", "created_at": "2026-04-01T00:00:00+00:00"})
+    asyncio.run(main(sys.argv[1]))
+    """
+    workers = [start_worker(tmp_path, code, prefix) for prefix in ("a", "b")]
+    assert [worker.wait(timeout=120) for worker in workers] == [0, 0]
+
+    server.db.refresh()
+    vehicles = asyncio.run(server.db.vehicles.find({}).to_list(None))
+    trips = asyncio.run(server.db.trips.find({}).to_list(None))
+    assert len({v["id"] for v in vehicles}) == len(vehicles) == 80
+    assert len({t["id"] for t in trips}) == len(trips) == 80
+
+
+def test_refresh_replays_other_workers_writes_into_derived_indexes(server, tmp_path):
+    asyncio.run(seed(server))
+    server.warm_start()
+    assert server.status_counters.counts["pending_cargo"] == 1
+
+    # The trip starts a month this worker has never seen
+    run_worker(tmp_path, """
+    async def main():
+        await server.db.trips.insert_one({trip!r})
+        await server.db.vehicles.update_one({{"id": "v1"}}, {{"$set": {{"status": "In Shop"}}}})
+        await server.db.trips.delete_one({{"id": "t-mar"}})
+    asyncio.run(main())
+    """.format(trip=trip("t-dec", "2026-12-03T08:00:00+00:00", origin="Zurich")))
+
+    server.db.refresh()
+    assert server.status_counters.counts["pending_cargo"] == 1
+    assert server.status_counters.counts["maintenance_alerts"] == 1
+    assert [r["id"] for r in server.search_index.search("zurich", set(server.SEARCH_FIELDS), 10)] == ["t-dec"]
+    assert_derived_match_rebuild(server)
+
+
+def test_archive_round_trip(server, tmp_path):
+    asyncio.run(seed(server))
+    asyncio.run(server.db.trips.insert_one(trip("t-old-draft", "2026-01-20T08:00:00+00:00")))
+    server.warm_start()
+    completed_before = server.status_counters.counts["completed_trips"]
+
+    run_worker(tmp_path, """
+    moved = server.db.trips.archive("2026-03-01", {"status": {"$in": server.FINISHED_TRIP_STATUSES}})
+    assert moved == 1, moved
+    """)
+
+    server.db.refresh()
+    # Telling the archived trip from a deleted one did not pull the archive into memory
+    assert [partition._data for partition in server.db.trips.cold.values()] == [None]
+    hot = asyncio.run(server.db.trips.find({}).to_list(None))
+    everything = asyncio.run(server.db.trips.find({}, include_archived=True).to_list(None))
+    assert {t["id"] for t in hot} == {"t-mar", "t-old-draft"}
+    assert [t for t in everything if t["id"] == "t-feb"] == [trip("t-feb", "2026-02-10T08:00:00+00:00", "Completed")]
+    assert asyncio.run(server.db.trips.find_one({"id": "t-feb"})) is None
+    # Archived trips still count towards the dashboard totals
+    assert server.status_counters.counts["completed_trips"] == completed_before
+    assert_derived_match_rebuild(server)
+
+
+def test_snapshot_restore_matches_full_rebuild(server, tmp_path, monkeypatch):
+    asyncio.run(seed(server))
+    server.warm_start()
+    server.write_snapshot()
+
+    # Edits made while no worker is running
+    run_worker(tmp_path, """
+    async def main():
+        await server.db.trips.insert_one({trip!r})
+        await server.db.drivers.update_one({{"id": "d1"}}, {{"$set": {{"status": "Suspended"}}}})
+        await server.db.trips.delete_one({{"id": "t-mar"}})
+    asyncio.run(main())
+    """.format(trip=trip("t-may", "2026-05-01T08:00:00+00:00")))
+
+    restarted = load_server(tmp_path, monkeypatch)
+    assert restarted.restore_snapshot() is True
+    assert restarted.dispatch_index.drivers == {}
+    assert_derived_match_rebuild(restarted)
+
+
+def test_snapshot_is_not_restored_after_a_partition_is_removed(server, tmp_path, monkeypatch):
+    asyncio.run(seed(server))
+    server.warm_start()
+    server.write_snapshot()
+    (tmp_path / "trips" / "2026-03.json").unlink()
+
+    restarted = load_server(tmp_path, monkeypatch)
+    assert restarted.restore_snapshot() is False
+
+
+def test_snapshot_signed_with_another_key_is_not_restored(server, tmp_path, monkeypatch):
+    asyncio.run(seed(server))
+    server.warm_start()
+    server.write_snapshot()
+
+    monkeypatch.setenv("SECRET_KEY", "another-key")
+    restarted = load_server(tmp_path, monkeypatch)
+    assert restarted.restore_snapshot() is False
+
+
+def test_snapshot_written_by_other_code_is_not_restored(server, tmp_path, monkeypatch):
+    asyncio.run(seed(server))
+    server.warm_start()
+    server.write_snapshot()
+
+    restarted = load_server(tmp_path, monkeypatch)
+    monkeypatch.setattr(restarted, "CODE_FINGERPRINT", "0" * 16)
+    assert restarted.restore_snapshot() is False
+
+
+def test_snapshots_are_disabled_with_the_default_secret_key(server, tmp_path, monkeypatch):
+    asyncio.run(seed(server))
+    monkeypatch.delenv("SECRET_KEY")
+    restarted = load_server(tmp_path, monkeypatch)
+    with pytest.raises(RuntimeError):
+        restarted.write_snapshot()
+    assert restarted.claim_snapshot_writer() is False
+
+    # A snapshot signed with the public default key, as anyone could forge it
+    monkeypatch.setattr(restarted, "SNAPSHOTS_ENABLED", True)
+    restarted.write_snapshot()
+    monkeypatch.setattr(restarted, "SNAPSHOTS_ENABLED", False)
+    assert restarted.restore_snapshot() is False
@@ -0,0 +1,72 @@
+"""Ranked search across vehicles, drivers and trips (GET /api/search)."""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from .helpers import assert_derived_match_rebuild, driver, trip, vehicle
+
+
+def search(server, q, types=None, limit=20):
+    response = asyncio.run(server.search(q, types, limit, {}))
+    return [(result["type"], result["id"], result["matched_field"]) for result in response["results"]]
+
+
+async def seed(server):
+    await server.db.vehicles.insert_one(vehicle("v-sharp", name="Sharp Van", license_plate="PL-1"))
+    await server.db.vehicles.insert_one(vehicle("v-blue", name="Blue Harbour", license_plate="PL-2"))
+    await server.db.vehicles.insert_one(vehicle("v-harbour", name="Harbour Express", license_plate="PL-3"))
+
+
+def test_field_prefixes_rank_before_word_prefixes_before_substrings(server):
+    asyncio.run(seed(server))
+
+    assert search(server, "Har") == [
+        ("vehicle", "v-harbour", "name"),
+        ("vehicle", "v-blue", "name"),
+        ("vehicle", "v-sharp", "name"),
+    ]
+    assert search(server, "har", limit=2) == [("vehicle", "v-harbour", "name"), ("vehicle", "v-blue", "name")]
+    # Too short for the trigram index: prefixes only
+    assert search(server, "ha") == [("vehicle", "v-harbour", "name"), ("vehicle", "v-blue", "name")]
+    assert search(server, "  ") == []
+
+
+def test_changes_reach_the_index_without_a_rebuild(server):
+    asyncio.run(seed(server))
+    server.warm_start()
+
+    async def edit():
+        await server.db.drivers.insert_one(driver("d-harriet", name="Harriet Vane"))
+        await server.db.vehicles.update_one({"id": "v-sharp"}, {"$set": {"name": "Old Tug"}})
+        await server.db.vehicles.delete_one({"id": "v-blue"})
+    asyncio.run(edit())
+
+    assert search(server, "har") == [("vehicle", "v-harbour", "name"), ("driver", "d-harriet", "name")]
+    assert search(server, "tug") == [("vehicle", "v-sharp", "name")]
+    assert_derived_match_rebuild(server)
+
+
+def test_types_narrow_the_collections_searched(server):
+    asyncio.run(seed(server))
+    asyncio.run(server.db.drivers.insert_one(driver("d-harriet", name="Harriet Vane")))
+
+    assert search(server, "har", types="drivers") == [("driver", "d-harriet", "name")]
+    with pytest.raises(HTTPException) as error:
+        search(server, "har", types="drivers,boats")
+    assert error.value.status_code == 400
+
+
+def test_long_fields_are_indexed_in_bounded_terms(server):
+    description = " ".join(f"crate{i:04d}" for i in range(1000))
+    asyncio.run(server.db.trips.insert_one(trip("t-long", "2026-05-01T08:00:00+00:00", cargo_description=description)))
+    server.warm_start()
+
+    terms = server.search_index.field_starts["trips"] + server.search_index.word_starts["trips"]
+    assert max(len(term[0]) for term in terms) == server.SEARCH_TERM_LENGTH
+
+    # Queries longer than the indexed terms are checked against the whole value
+    start = description.index("crate0500")
+    query = description[start:start + 2 * server.SEARCH_TERM_LENGTH]
+    assert search(server, query) == [("trip", "t-long", "cargo_description")]
+    assert search(server, query[:-1] + "#") == []